@@ -14,16 +14,84 @@ ______________________________
 from vip_hci.var import frame_center
 
 import torch
-from torch.nn.functional import conv2d
+from torch.nn.functional import conv2d, affine_grid, grid_sample
 import torch.fft as tf
 
 import numpy as np
+from functools import lru_cache
 from skimage.filters import threshold_multiotsu
 from vip_hci.var import frame_filter_lowpass
 
 # %% Operator on tensors
 # Mostly copies of vip functiun adapted to tensors
 
+# cuFFT plans are cached per (shape, dtype) : keep enough of them for the FFTs of one iteration (rotations, convolutions)
+if torch.cuda.is_available():
+    torch.backends.cuda.cufft_plan_cache.max_size = 64
+
+# Filter kernels. Tensors are built once per (key, dtype, device) and cached,
+# these filters are called at each iteration of the minimization.
+LAPLACIAN_KERNELS = {3: [[-1, -1, -1],
+                         [-1, 8, -1],
+                         [-1, -1, -1]],
+                     5: [[-4, -1, 0, -1, -4],
+                         [-1, 2, 3, 2, -1],
+                         [0, 3, 4, 3, 0],
+                         [-1, 2, 3, 2, -1],
+                         [-4, -1, 0, -1, -4]],
+                     7: [[-10, -5, -2, -1, -2, -5, -10],
+                         [-5, 0, 3, 4, 3, 0, -5],
+                         [-2, 3, 6, 7, 6, 3, -2],
+                         [-1, 4, 7, 8, 7, 4, -1],
+                         [-2, 3, 6, 7, 6, 3, -2],
+                         [-5, 0, 3, 4, 3, 0, -5],
+                         [-10, -5, -2, -1, -2, -5, -10]]}
+
+SOBEL_KERNELS = {"y": [[1, 0, -1],
+                       [2, 0, -2],
+                       [1, 0, -1]],
+                 "x": [[1, 2, 1],
+                       [0, 0, 0],
+                       [-1, -2, -1]]}
+
+GAUSSIAN_KERNELS = {3: [[1, 2, 1],
+                        [2, 4, 2],
+                        [1, 2, 1]],
+                    5: [[1,  4,  6,  4, 1],
+                        [4, 18, 30, 18, 4],
+                        [6, 30, 48, 30, 6],
+                        [4, 18, 30, 18, 4],
+                        [1,  4,  6,  4, 1]]}
+
+# 1D factors of the separable kernels (k x k kernel = outer product of the 1D kernel with itself)
+# The 5x5 gaussian is not rank-1 and is kept dense.
+GAUSSIAN_KERNELS_1D = {3: [1, 2, 1]}
+
+_kernel_cache = {}
+
+
+def get_kernel(name: str, key, ref: torch.Tensor) -> torch.Tensor:
+    """ Return the (1, 1, k, k) kernel tensor of the filter 'name', on the device and dtype of ref.
+    1D kernels ('gaussian_1d') are returned with shape (1, 1, 1, k).
+    'sobel_xy' (key ignored) is the stack of the x and y sobel kernels, shape (2, 1, 3, 3).
+    Built on first call then cached. """
+
+    cache_key = (name, key, ref.dtype, ref.device)
+    kernel = _kernel_cache.get(cache_key)
+    if kernel is None:
+        if name == "sobel_xy":
+            values = [[SOBEL_KERNELS["x"]], [SOBEL_KERNELS["y"]]]
+        else:
+            values = {"laplacian": LAPLACIAN_KERNELS, "sobel": SOBEL_KERNELS, "gaussian": GAUSSIAN_KERNELS,
+                      "gaussian_1d": GAUSSIAN_KERNELS_1D}[name][key]
+            if name.endswith("_1d"): values = [values]
+            values = [[values]]
+        kernel = torch.tensor(values, dtype=ref.dtype, device=ref.device)
+        _kernel_cache[cache_key] = kernel
+
+    return kernel
+
+
 def laplacian_tensor_conv(tensor: torch.Tensor, kernel_size=3) -> torch.Tensor:
     """
     Apply laplacian filter on input tensor X
@@ -41,30 +109,9 @@ def laplacian_tensor_conv(tensor: torch.Tensor, kernel_size=3) -> torch.Tensor:
 
     """
 
-    kernel3 = torch.Tensor([[[[-1, -1, -1],
-                              [-1, 8, -1],
-                              [-1, -1, -1]]]])
-    kernel5 = torch.Tensor([[[[-4, -1, 0, -1, -4],
-                              [-1, 2, 3, 2, -1],
-                              [0, 3, 4, 3, 0],
-                              [-1, 2, 3, 2, -1],
-                              [-4, -1, 0, -1, -4]]]])
-    kernel7 = torch.Tensor([[[[-10, -5, -2, -1, -2, -5, -10],
-                              [-5, 0, 3, 4, 3, 0, -5],
-                              [-2, 3, 6, 7, 6, 3, -2],
-                              [-1, 4, 7, 8, 7, 4, -1],
-                              [-2, 3, 6, 7, 6, 3, -2],
-                              [-5, 0, 3, 4, 3, 0, -5],
-                              [-10, -5, -2, -1, -2, -5, -10]]]])
-
-    if kernel_size == 3:
-        kernel = kernel3
-    elif kernel_size == 5:
-        kernel = kernel5
-    elif kernel_size == 7:
-        kernel = kernel7
-    else:
+    if kernel_size not in LAPLACIAN_KERNELS:
         raise ValueError('Kernel size must be either 3, 5 or 7.')
+    kernel = get_kernel("laplacian", kernel_size, tensor)
     filtered = conv2d(torch.unsqueeze(tensor, 0), kernel, padding='same')
 
     return filtered
@@ -87,24 +134,36 @@ def sobel_tensor_conv(tensor: torch.Tensor, axis="y") -> torch.Tensor:
     torch.Tensor
 
     """
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    if axis not in SOBEL_KERNELS : raise ValueError("'Axis' parameters should be 'x' or 'y', not"+str(axis))
+    kernel = get_kernel("sobel", axis, tensor)
+
+    if not tensor.is_contiguous(): tensor = tensor.contiguous()
+    filtered = conv2d(torch.unsqueeze(tensor, 0), kernel, padding='same')
 
-    if axis == "y":
-        kernel = np.array([[[1, 0, -1],
-                             [2, 0, -2],
-                             [1, 0, -1]]], dtype='float64')
-    elif axis == "x":
-        kernel = np.array([[[1, 2, 1],
-                            [0, 0, 0],
-                            [-1, -2, -1]]], dtype='float64')
-    else : raise ValueError("'Axis' parameters should be 'x' or 'y', not"+str(axis))
+    return filtered
 
-    kernel = torch.unsqueeze(torch.from_numpy(kernel), 0).double().to(device)
 
-    shape = tensor.shape
-    filtered = conv2d(tensor.reshape( (1,) + shape), kernel, padding='same')
+def sobel_sq_tensor_conv(tensor: torch.Tensor) -> torch.Tensor:
+    """
+    Squared norm of the sobel gradient of input tensor X : sobel_x(X)**2 + sobel_y(X)**2
+    Both directions are computed with a single conv (2 output channels).
 
-    return filtered
+    Parameters
+    ----------
+    tensor : torch.tensor
+        input tensor
+
+    Returns
+    -------
+    torch.Tensor
+
+    """
+    kernel = get_kernel("sobel_xy", None, tensor)
+
+    if not tensor.is_contiguous(): tensor = tensor.contiguous()
+    filtered = conv2d(torch.unsqueeze(tensor, 0), kernel, padding='same')
+
+    return torch.sum(filtered * filtered, dim=1, keepdim=True)
 
 
 def gaussian_tensor_conv(tensor: torch.Tensor, k_size = 5) -> torch.Tensor:
@@ -124,27 +183,21 @@ def gaussian_tensor_conv(tensor: torch.Tensor, k_size = 5) -> torch.Tensor:
     torch.Tensor
 
     """
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
-    if k_size == 3 :
-        kernel = np.array([[[1, 2, 1],
-                            [2, 4, 2],
-                            [1, 2, 1]]], dtype='float64')
-    elif k_size == 5:
-        kernel = np.array([[[1,  4,  6,  4, 1],
-                            [4, 18, 30, 18, 4],
-                            [6, 30, 48, 30, 6],
-                            [4, 18, 30, 18, 4],
-                            [1,  4,  6,  4, 1]]], dtype='float64')
-    else : raise(ValueError("Kernel size can be {3,5}"))
-
-    kernel = torch.unsqueeze(torch.from_numpy(kernel), 0).double().to(device)
-    filtered = conv2d(tensor, kernel, padding='same')
+    if k_size not in GAUSSIAN_KERNELS : raise(ValueError("Kernel size can be {3,5}"))
+
+    if k_size in GAUSSIAN_KERNELS_1D:
+        # Separable kernel : one horizontal then one vertical 1D pass (2k instead of k² op per pixel)
+        kernel = get_kernel("gaussian_1d", k_size, tensor)
+        filtered = conv2d(tensor, kernel, padding='same')
+        filtered = conv2d(filtered, kernel.transpose(2, 3), padding='same')
+    else:
+        kernel = get_kernel("gaussian", k_size, tensor)
+        filtered = conv2d(tensor, kernel, padding='same')
 
     return filtered
 
 
-def tensor_rotate_fft(tensor: torch.Tensor, angle: float) -> torch.Tensor:
+def tensor_rotate_fft(tensor: torch.Tensor, angle: float, mode="fft", dtype=None) -> torch.Tensor:
     """ Rotates Tensor using Fourier transform phases:
         Rotation = 3 consecutive lin. shears = 3 consecutive FFT phase shifts
         See details in Larkin et al. (1997) and Hagelberg et al. (2016).
@@ -170,6 +223,11 @@ def tensor_rotate_fft(tensor: torch.Tensor, angle: float) -> torch.Tensor:
         Input image, 2d array.
     angle : float
         Rotation angle.
+    mode : {"fft", "bilinear", "bicubic"}
+        If "fft", rotation by FFT shears (flux preserving).
+        Otherwise, interpolated rotation with grid_sample (see tensor_rotate_interp), much faster.
+    dtype : torch.dtype or None
+        Real dtype of the FFT shears. See tensor_rotate_fft_batch.
 
     Returns
     -------
@@ -177,69 +235,282 @@ def tensor_rotate_fft(tensor: torch.Tensor, angle: float) -> torch.Tensor:
         Resulting frame.
 
     """
-    y_ori, x_ori = tensor.shape[1:]
-
-    while angle < 0:
-        angle += 360
-    while angle > 360:
-        angle -= 360
-
-    if angle > 45:
-        dangle = angle % 90
-        if dangle > 45:
-            dangle = -(90 - dangle)
-        nangle = int(np.rint(angle / 90))
-        tensor_in = torch.rot90(tensor, nangle, [1, 2])
-    else:
-        dangle = angle
-        tensor_in = tensor.clone()
+    if mode != "fft": return tensor_rotate_interp(tensor, angle, mode)
 
-    if y_ori % 2 or x_ori % 2:
-        # NO NEED TO SHIFT BY 0.5px: FFT assumes rot. center on cx+0.5, cy+0.5!
-        tensor_in = tensor_in[:, :-1, :-1]
+    return tensor_rotate_fft_batch(tensor, np.full(tensor.shape[0], angle, dtype=float), dtype)
+
+
+def tensor_rotate_fft_batch(cube: torch.Tensor, angles: np.array, dtype=None) -> torch.Tensor:
+    """ Rotates each frame of a cube by its own angle using Fourier transform phases.
+        Same algorithm as tensor_rotate_fft, but the 3 shears are processed as batched FFTs over the
+        whole cube (the phase term is broadcast along the frames).
 
-    a = np.tan(np.deg2rad(dangle) / 2).item()
-    b = -np.sin(np.deg2rad(dangle)).item()
+    Parameters
+    ----------
+    cube : torch.Tensor
+        Input cube, 3d tensor (N, H, W).
+    angles : np.array or torch.Tensor
+        Rotation angles, one per frame (N).
+    dtype : torch.dtype or None
+        Real dtype of the FFT shears (phase grids and shear factors). If None, follows the dtype of the
+        cube, so the input is never promoted (float32 -> complex64 FFTs) and the FFT plans are reused.
 
-    y_new, x_new = tensor_in.shape[1:]
-    arr_xy = torch.from_numpy(np.mgrid[0:y_new, 0:x_new])
-    cy, cx = frame_center(tensor[0])
-    arr_y = arr_xy[0] - cy
-    arr_x = arr_xy[1] - cx
+    Returns
+    -------
+    array_out : torch.Tensor
+        Resulting cube.
+
+    """
+    if dtype is None: dtype = cube.dtype if cube.is_floating_point() else torch.float64
+
+    dangle, nangle = split_rot_angles(angles)
+    phase_x, phase_y = shear_phases(tuple(cube.shape[1:]), dangle, cube.device, dtype)
+
+    return tensor_rotate_fft_phases(cube, nangle, phase_x, phase_y)
+
+
+class FFTRotator():
+    """ FFT rotation (see tensor_rotate_fft_batch) specialized for a fixed frame shape and a fixed list of angles.
+        The shear phases of all the angles are computed once at init, each call only does the FFTs and products.
+        Use it when the same angles are applied at each iteration (i.e parallactic angles of the cube).
+
+        (!) The phases are stored for all angles : 2 complex (N, H, W) tensors.
+
+    Parameters
+    ----------
+    shape : tuple
+        Frame shape (H, W).
+    angles : np.array
+        Rotation angles (N).
+    device : torch.device
+    dtype : torch.dtype
+        Real dtype of the FFT shears.
+
+    """
+
+    def __init__(self, shape: tuple, angles: np.array, device: torch.device, dtype=torch.float64):
+        self.shape = tuple(shape)
+        self.dangle, self.nangle = split_rot_angles(angles)
+        self.phase_x, self.phase_y = shear_phases(self.shape, self.dangle, device, dtype)
+
+    def __call__(self, cube: torch.Tensor, frame_ids=None) -> torch.Tensor:
+        """ Rotates the frames of the cube by the angles frame_ids (int, slice or list; all angles if None).
+            The cube has one frame per selected angle, i.e (1, H, W) for an int. """
+        if frame_ids is None: frame_ids = slice(None)
+        elif isinstance(frame_ids, (int, np.integer)): frame_ids = slice(frame_ids, frame_ids + 1)
+
+        return tensor_rotate_fft_phases(cube, self.nangle[frame_ids], self.phase_x[frame_ids],
+                                        self.phase_y[frame_ids])
+
+
+def split_rot_angles(angles: np.array) -> tuple:
+    """ Split rotation angles in a rot90 (nangle, number of quarter turns) and a rotation dangle in [-45, 45]
+    performed by the FFT shears. """
+    if isinstance(angles, torch.Tensor): angles = angles.detach().cpu().numpy()
+    angles = np.array(angles, dtype=float) % 360
+
+    # Rotation > 45° are performed with a rot90 + a rotation of dangle in [-45, 45]
+    big_rot = angles > 45
+    dangle = np.where(big_rot, angles % 90, angles)
+    dangle = np.where(big_rot & (dangle > 45), -(90 - dangle), dangle)
+    nangle = np.where(big_rot, np.rint(angles / 90), 0).astype(int) % 4
+
+    return dangle, nangle
+
+
+def shear_phases(shape: tuple, dangle: np.array, device: torch.device, dtype=torch.float64) -> tuple:
+    """ Phase terms (phase_x, phase_y) of the 3 FFT shears (x, y, x) of the rotations by dangle,
+    for frames of the given shape (before the crop of odd sizes). Complex tensors (N, H, W). """
+    y_ori, x_ori = shape
+    center = frame_center(np.empty(shape))
+    if y_ori % 2 or x_ori % 2: shape = (y_ori - 1, x_ori - 1)
+
+    # One shear factor per frame, shaped to broadcast on (N, H, W)
+    rad = torch.as_tensor(np.deg2rad(dangle), dtype=dtype, device=device).reshape(len(dangle), 1, 1)
+    a = torch.tan(rad / 2)
+    b = -torch.sin(rad)
+
+    phase_x = shear_phase(shear_phase_grid(shape, center, 2, device, dtype), a)
+    phase_y = shear_phase(shear_phase_grid(shape, center, 1, device, dtype), b)
+
+    return phase_x, phase_y
+
+
+def tensor_rotate_fft_phases(cube: torch.Tensor, nangle: np.array, phase_x: torch.Tensor,
+                             phase_y: torch.Tensor) -> torch.Tensor:
+    """ FFT rotation of the frames of the cube from precomputed rot90 (nangle) and shear phases (see shear_phases). """
+    nb_frame, y_ori, x_ori = cube.shape
+
+    # The shears never write in their input : no copy needed unless some frames are rot90-ed
+    cube_in = cube.clone() if np.any(nangle) else cube
+    # Angles are usually monotonic : frames sharing a rot90 come in runs, rotated from a slice (view) of the cube
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(nangle)) + 1, [nb_frame]))
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        if nangle[start]: cube_in[start:stop] = rot90_view(cube[start:stop], nangle[start])
+
+    if y_ori % 2 or x_ori % 2:
+        # NO NEED TO SHIFT BY 0.5px: FFT assumes rot. center on cx+0.5, cy+0.5!
+        cube_in = cube_in[:, :-1, :-1]
 
-    s_x = tensor_fft_shear(tensor_in, arr_x, a, ax=2)
-    s_xy = tensor_fft_shear(s_x, arr_y, b, ax=1)
-    s_xyx = tensor_fft_shear(s_xy, arr_x, a, ax=2)
+    s_x = tensor_fft_shear_precomputed(cube_in, phase_x, ax=2)
+    s_xy = tensor_fft_shear_precomputed(s_x, phase_y, ax=1)
+    s_xyx = tensor_fft_shear_precomputed(s_xy, phase_x, ax=2)
 
     if y_ori % 2 or x_ori % 2:
         # set it back to original dimensions
-        array_out = torch.zeros([1, s_xyx.shape[1]+1, s_xyx.shape[2]+1])
-        array_out[0, :-1, :-1] = torch.real(s_xyx)
+        array_out = torch.zeros(cube.shape, dtype=s_xyx.real.dtype, device=cube.device)
+        array_out[:, :-1, :-1] = torch.real(s_xyx)
     else:
         array_out = torch.real(s_xyx)
 
     return array_out
 
 
-def tensor_fft_shear(arr, arr_ori, c, ax):
+def rot90_view(cube: torch.Tensor, n_rot: int) -> torch.Tensor:
+    """ Frames of the cube rotated by n_rot*90° (counter-clockwise, as torch.rot90 on dims [1, 2]).
+    Written as flip + transpose : the transpose is a view and the result is left non-contiguous,
+    the only copy is the flip (torch has no negative strides) or the assignment it is written in. """
+    n_rot = int(n_rot) % 4
+    if n_rot == 1: return cube.flip(2).transpose(1, 2)
+    if n_rot == 2: return cube.flip((1, 2))
+    if n_rot == 3: return cube.transpose(1, 2).flip(2)
+    return cube
+
+
+def tensor_rotate_interp(tensor: torch.Tensor, angle: float, mode="bilinear") -> torch.Tensor:
+    """ Rotates Tensor with an interpolation (one affine_grid + grid_sample).
+        Same convention as torchvision rotate : positive angle is counter-clockwise,
+        around the center of the frame (between the 4 central pixels for even dimensions).
+
+    Parameters
+    ----------
+    tensor : torch.Tensor
+        Input image(s), 3d tensor (C, H, W).
+    angle : float
+        Rotation angle in degree.
+    mode : {"bilinear", "bicubic", "nearest"}
+        Interpolation mode.
+
+    Returns
+    -------
+    torch.Tensor
+        Rotated frame(s), same shape as input.
+
+    """
+    ang = np.deg2rad(angle)
+    cos_a, sin_a = np.cos(ang).item(), np.sin(ang).item()
+    theta = torch.tensor([[[cos_a, -sin_a, 0], [sin_a, cos_a, 0]]], dtype=tensor.dtype, device=tensor.device)
+
+    grid = affine_grid(theta, [1, *tensor.shape], align_corners=False)
+
+    return grid_sample(torch.unsqueeze(tensor, 0), grid, mode=mode, align_corners=False)[0]
+
+
+def tensor_cube_derotate(cube: torch.Tensor, angles, mode="bilinear") -> torch.Tensor:
+    """ Derotates each frame of a cube by its angle (i.e rotation of -angle) with one batched grid_sample.
+        Torch equivalent of vip cube_derotate : same direction and same center of rotation (frame_center),
+        on the device of the cube.
+
+    Parameters
+    ----------
+    cube : torch.Tensor
+        Input cube, 3d tensor (N, H, W).
+    angles : np.array or torch.Tensor
+        List of angles in degree (N).
+    mode : {"bilinear", "bicubic", "nearest"}
+        Interpolation mode.
+
+    Returns
+    -------
+    torch.Tensor
+        Derotated cube (N, H, W).
+
+    """
+    if isinstance(angles, torch.Tensor): angles = angles.detach().cpu().numpy()
+    grid = derotation_grid(tuple(np.asarray(angles, dtype=float).tolist()), tuple(cube.shape[1:]),
+                           cube.device, cube.dtype)
+
+    return grid_sample(torch.unsqueeze(cube, 1), grid, mode=mode, align_corners=False)[:, 0]
+
+
+def tensor_frame_derotate(frame: torch.Tensor, angles, mode="bilinear") -> torch.Tensor:
+    """ Derotates one frame (H, W) by each angle (N) : same as tensor_cube_derotate of the frame repeated N times,
+    but the frame is expanded (no copy). Returns a (N, H, W) tensor. """
+    return tensor_cube_derotate(frame.expand(len(angles), *frame.shape), angles, mode)
+
+
+@lru_cache(maxsize=4)
+def derotation_grid(angles: tuple, shape: tuple, device: torch.device, dtype=torch.float64) -> torch.Tensor:
+    """ Sampling grid (N, H, W, 2) of tensor_cube_derotate. Only depends on the angles and on the size of the frames :
+    cached (the angles of a cube don't change), do not modify the returned tensor in place. """
+    y_siz, x_siz = shape
+    theta = -torch.deg2rad(torch.as_tensor(angles, dtype=dtype, device=device))
+    cos_a, sin_a = torch.cos(theta), torch.sin(theta)
+
+    # Rotation around frame_center (normalized coordinates) : x_in = R.x_out + (I - R).c
+    cy, cx = frame_center(np.empty(shape))
+    c_x, c_y = (2 * cx + 1) / x_siz - 1, (2 * cy + 1) / y_siz - 1
+    affine = torch.stack([torch.stack([cos_a, -sin_a, c_x - (cos_a * c_x - sin_a * c_y)], -1),
+                          torch.stack([sin_a, cos_a, c_y - (sin_a * c_x + cos_a * c_y)], -1)], 1)
+
+    return affine_grid(affine, [len(angles), 1, y_siz, x_siz], align_corners=False)
+
+
+@lru_cache(maxsize=32)
+def rotation_grids(shape: tuple, center: tuple, device: torch.device, dtype=torch.float64) -> tuple:
+    """ Pixel grids (arr_y, arr_x) centred on center for a frame of the given shape.
+    Only depends on the size of the frames : cached, do not modify the returned tensors in place. """
+    arr_xy = torch.as_tensor(np.mgrid[0:shape[0], 0:shape[1]], dtype=dtype, device=device)
+    return arr_xy[0] - center[0], arr_xy[1] - center[1]
+
+
+@lru_cache(maxsize=32)
+def shear_freq_grid(shape: tuple, ax: int, device: torch.device, dtype=torch.float64) -> torch.Tensor:
+    """ Shifted frequency grid used by tensor_fft_shear along axis ax.
+    Only depends on the size of the frames : cached, do not modify the returned tensor in place. """
     ax2 = 1 - (ax-1) % 2
-    freqs = tf.fftfreq(arr_ori.shape[ax2], dtype=torch.float64)
+    freqs = tf.fftfreq(shape[ax2], dtype=dtype, device=device)
     sh_freqs = tf.fftshift(freqs)
-    arr_u = torch.tile(sh_freqs, (arr_ori.shape[ax-1], 1))
+    arr_u = torch.tile(sh_freqs, (shape[ax-1], 1))
     if ax == 2:
         arr_u = torch.transpose(arr_u, 0, 1)
-    s_x = tf.fftshift(arr)
-    s_x = tf.fft(s_x, dim=ax)
-    s_x = tf.fftshift(s_x)
-    s_x = torch.exp(-2j * torch.pi * c * arr_u * arr_ori) * s_x
-    s_x = tf.fftshift(s_x)
+    return arr_u
+
+
+@lru_cache(maxsize=32)
+def shear_phase_grid(shape: tuple, center: tuple, ax: int, device: torch.device, dtype=torch.float64) -> torch.Tensor:
+    """ Phase grid (u * x) of the FFT shear along axis ax, in un-shifted FFT order.
+    The shifted version of the shear (fftshift/fft/fftshift - phase - fftshift/ifft/fftshift) is equivalent,
+    for even sizes, to an un-shifted fft/ifft with the pixel grid ifftshifted along the FFT axis.
+    Only depends on the size of the frames : cached, do not modify the returned tensor in place. """
+    arr_y, arr_x = rotation_grids(shape, center, device, dtype)
+    arr_ori = arr_x if ax == 2 else arr_y
+    return shear_freq_grid(shape, ax, device, dtype) * tf.ifftshift(arr_ori, dim=ax-1)
+
+
+def shear_phase(phase_grid, c):
+    """ Phase term exp(-2i.pi.c.grid) of the FFT shear. c is a float or a (N, 1, 1) tensor (one factor per frame).
+    Built from its real angle with cos/sin (no complex exp), the factor c is scaled first as it is (N,1,1). """
+    angle = (-2 * torch.pi * c) * phase_grid
+    return torch.complex(torch.cos(angle), torch.sin(angle))
+
+
+def tensor_fft_shear(arr, phase_grid, c, ax):
+    """ FFT shear of a (N, H, W) tensor along axis ax. c is a float or a (N, 1, 1) tensor (one factor per frame).
+    phase_grid is given by shear_phase_grid. Frames must have even sizes (see tensor_rotate_fft_batch). """
+    return tensor_fft_shear_precomputed(arr, shear_phase(phase_grid, c), ax)
+
+
+def tensor_fft_shear_precomputed(arr, phase, ax):
+    """ FFT shear of a (N, H, W) tensor along axis ax with its phase term given by shear_phase. """
+    s_x = tf.fft(arr, dim=ax)
+    s_x = s_x.mul_(phase)  # the FFT output is multiplied in place
     s_x = tf.ifft(s_x, dim=ax)
-    s_x = tf.fftshift(s_x)
 
     return s_x
 
 
-def tensor_fft_scale(array: torch.Tensor, scale: float, ori_dim=True):
+def tensor_fft_scale(array: torch.Tensor, scale: float, ori_dim=True, dtype=None, method="fft"):
     """
     Resample the frames of a cube with a single scale factor using a FFT-based
     method.
@@ -255,12 +526,26 @@ def tensor_fft_scale(array: torch.Tensor, scale: float, ori_dim=True):
         same dimensions as the input array. By default, the x,y dimensions of
         the output are the closest integer to scale*dim_input, with the same
         parity as the input.
+    dtype: torch.dtype or None, opt
+        Real dtype used for the computation (and the matching complex dtype for the FFTs).
+        If None, follows the dtype of the input (i.e. float32 input -> complex64 FFTs).
+        Set torch.float64 to force double precision.
+    method: {"fft", "bilinear", "bicubic"}, opt
+        "fft" (default) is the exact FFT-based resampling.
+        "bilinear"/"bicubic" use torch interpolate (antialiased), much faster but
+        total flux is kept but the interpolation kernels smooth the frames : expect
+        photometric biases on sharp features (i.e psf core). See tensor_interp_scale.
     Returns
     -------
     array_resc : numpy ndarray
         Output cube with resampled frames.
     """
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    if method != "fft":
+        return tensor_interp_scale(array, scale, ori_dim, method)
+
+    device = array.device
+    if dtype is None: dtype = array.dtype if array.is_floating_point() else torch.float64
+    cdtype = torch.complex64 if dtype == torch.float32 else torch.complex128
 
     if scale == 1:
         return array
@@ -269,17 +554,17 @@ def tensor_fft_scale(array: torch.Tensor, scale: float, ori_dim=True):
 
     if array.shape[0] % 2 :
         odd = True
-        array_even = torch.zeros([array.shape[1] + 1, array.shape[2] + 1])
+        array_even = torch.zeros([array.shape[1] + 1, array.shape[2] + 1], dtype=dtype, device=device)
         array_even[1:, 1:] = array[0]
         array = array_even
     else:
-        array_even = torch.zeros([array.shape[1], array.shape[2]])
+        array_even = torch.zeros([array.shape[1], array.shape[2]], dtype=dtype, device=device)
         array_even[:, :] = array[0]
         array = array_even
         odd = False
 
     dim = array.shape[0]  # even square
-    kd_array = torch.arange(dim//2 + 1)
+    kd_array = torch.arange(dim//2 + 1, device=device)
 
     # scaling factor chosen as *close* as possible to N''/N', where:
     #   N' = N + 2*KD (N': dim after FT)
@@ -288,7 +573,8 @@ def tensor_fft_scale(array: torch.Tensor, scale: float, ori_dim=True):
     #   => KF = (N"-N)/2 = round(N'*sc/2 - N/2)
     #         = round(N/2*(sc-1) + KD*sc)
     # We call yy=N/2*(sc-1) +KD*sc
-    yy = dim/2 * (scale - 1) + kd_array.double().to(device) * scale
+    # (kept in double whatever dtype : the choice of KD is sensitive to rounding errors)
+    yy = dim/2 * (scale - 1) + kd_array.double() * scale
 
     # We minimize the difference between the `ideal' N" and its closest
     # integer value by minimizing |yy-int(yy)|.
@@ -301,7 +587,7 @@ def tensor_fft_scale(array: torch.Tensor, scale: float, ori_dim=True):
 
     # Extract a part of array and place into dim_p array
     dim_p = int(dim + 2*kd_io)
-    tmp = torch.zeros((dim_p, dim_p)).double().to(device)
+    tmp = torch.zeros((dim_p, dim_p), dtype=dtype, device=device)
     tmp[kd_io:kd_io+dim, kd_io:kd_io+dim] = array
 
     # Fourier-transform the larger array
@@ -311,7 +597,7 @@ def tensor_fft_scale(array: torch.Tensor, scale: float, ori_dim=True):
     dim_pp = int(dim + 2*kf_io)
 
     if dim_pp > dim_p:
-        tmp = torch.zeros((dim_pp, dim_pp), dtype=torch.cfloat)
+        tmp = torch.zeros((dim_pp, dim_pp), dtype=cdtype, device=device)
         tmp[(dim_pp-dim_p)//2:(dim_pp+dim_p)//2,
             (dim_pp-dim_p)//2:(dim_pp+dim_p)//2] = array_f
     else:
@@ -334,7 +620,7 @@ def tensor_fft_scale(array: torch.Tensor, scale: float, ori_dim=True):
         array_resc = array_resc[(dim_pp-dim_resc)//2:(dim_pp+dim_resc)//2,
                                 (dim_pp-dim_resc)//2:(dim_pp+dim_resc)//2]
     elif not ori_dim and dim_pp <= dim_resc:
-        array = torch.zeros((dim_resc, dim_resc)).double().to(device)
+        array = torch.zeros((dim_resc, dim_resc), dtype=dtype, device=device)
         array[(dim_resc-dim_pp)//2:(dim_resc+dim_pp)//2,
               (dim_resc-dim_pp)//2:(dim_resc+dim_pp)//2] = array_resc
         array_resc = array
@@ -348,19 +634,86 @@ def tensor_fft_scale(array: torch.Tensor, scale: float, ori_dim=True):
     # array_resc /= scale * scale
 
     if odd:
-        array_tmp = torch.zeros([1, array_resc.shape[0]-1, array_resc.shape[1]-1])
+        array_tmp = torch.zeros([1, array_resc.shape[0]-1, array_resc.shape[1]-1], dtype=dtype, device=device)
         array_tmp[0] = array_resc[1:, 1:]
         array_resc = array_tmp
     else :
-        array_tmp = torch.zeros([1, array_resc.shape[0], array_resc.shape[1]])
+        array_tmp = torch.zeros([1, array_resc.shape[0], array_resc.shape[1]], dtype=dtype, device=device)
         array_tmp[0] = array_resc
         array_resc = array_tmp
 
     return array_resc
 
 
+def tensor_interp_scale(array: torch.Tensor, scale: float, ori_dim=True, method="bicubic"):
+    """
+    Resample the frames of a cube with torch interpolate (antialiased), about the frame center.
+    Fast alternative to tensor_fft_scale. Output size follows the same rules as tensor_fft_scale.
+    """
+    if scale == 1:
+        return array
+
+    shape = array.shape[-2:]
+    if ori_dim:
+        new_shape = shape
+    else:
+        new_shape = []
+        for dim in shape:
+            dim_resc = int(round(scale*dim))
+            if dim_resc > dim and dim_resc % 2 != dim % 2:
+                dim_resc += 1
+            elif dim_resc < dim and dim_resc % 2 != dim % 2:
+                dim_resc -= 1  # for reversibility
+            new_shape.append(dim_resc)
+
+    # Size of the scaled frames with the same parity as the output, so it can be centered
+    scaled_shape = []
+    for dim, out_dim in zip(shape, new_shape):
+        dim_sc = int(round(scale*dim))
+        if dim_sc % 2 != out_dim % 2:
+            dim_sc += 1
+        scaled_shape.append(dim_sc)
+
+    res = torch.nn.functional.interpolate(torch.unsqueeze(array, 1), size=scaled_shape, mode=method,
+                                          align_corners=False, antialias=True)[:, 0]
+    res /= (scaled_shape[0] / shape[0]) * (scaled_shape[1] / shape[1])  # total flux as the fft method
+
+    # Crop/pad the scaled frames to the output dimensions
+    array_resc = torch.zeros((array.shape[0], *new_shape), dtype=res.dtype, device=res.device)
+    (sy, sx), (ny, nx) = scaled_shape, new_shape
+    cy, cx = min(sy, ny), min(sx, nx)
+    array_resc[:, (ny-cy)//2:(ny+cy)//2, (nx-cx)//2:(nx+cx)//2] = \
+        res[:, (sy-cy)//2:(sy+cy)//2, (sx-cx)//2:(sx+cx)//2]
+
+    return array_resc
+
+
 def tensor_conv(x: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
-    return torch.abs(tf.ifftshift(tf.ifft2(tf.fftshift(tf.fft2(x)) * tf.fftshift(tf.fft2(y)))))
+    """ FFT convolution of x by y (y centred). See tensor_conv_precomputed """
+    if y.is_complex() and not x.is_complex():
+        return torch.abs(tf.ifft2(tf.fft2(x) * tensor_kernel_fft(y, full=True)))
+    return tensor_conv_precomputed(x, tensor_kernel_fft(y, full=x.is_complex()))
+
+
+def tensor_kernel_fft(y: torch.Tensor, full=False) -> torch.Tensor:
+    """ Fourier transform of a centred kernel y, as expected by tensor_conv_precomputed.
+    The ifftshift that centres the convolution output is applied here on the kernel (circular convolution :
+    shifting the kernel shifts the output), so it is done once instead of on each convolution.
+    rfft2 (half spectrum) for a real input x, fft2 if full (complex input x). """
+    y = tf.ifftshift(y, dim=(-2, -1))
+    return tf.fft2(y) if full else tf.rfft2(y)
+
+
+def tensor_conv_precomputed(x: torch.Tensor, y_fft: torch.Tensor) -> torch.Tensor:
+    """ FFT convolution of x by a kernel given by its Fourier transform y_fft (see tensor_kernel_fft).
+    Use it when the kernel is fixed (i.e psf) to not recompute its FFT at each call.
+    For real x, y_fft is a rfft2 (half spectrum, half the FFT work and memory). For complex x, a fft2.
+
+    The fftshifts around the product only multiply the result by a phase term, removed by the abs.
+    """
+    if x.is_complex():
+        return torch.abs(tf.ifft2(tf.fft2(x) * y_fft))
+    return torch.abs(tf.irfft2(tf.rfft2(x) * y_fft, s=x.shape[-2:]))
 
 
 def convert_to_mask(img: np.ndarray):
@@ -15,7 +15,7 @@ import numpy as np
 import torch
 
 # FFT tensor operator
-from mustard.algo import tensor_conv, tensor_rotate_fft, tensor_fft_scale
+from mustard.algo import tensor_conv_precomputed, tensor_kernel_fft, tensor_rotate_fft, tensor_fft_scale, FFTRotator
 
 # Regular interpolated tensor operators
 from torchvision.transforms.functional import rotate
@@ -28,15 +28,26 @@ ReLU = reluConstr()
 
 # I used this to switch rotation methods
 # Could have been added as an option or chose the one to keep...
-tensor_rotate =  lambda frame, angle : rotate(frame, angle, InterpolationMode.BILINEAR) # OR tensor_rotate_fft(frame, angle)
+# (ADI : model_ADI(rotation="fft") rotates by the angles of the cube with FFT shears, phases precomputed once)
+# Out of torch.compile graphs (mustard_estimator.estimate(compile_step=True)) : torchvision rotate takes a python
+# float angle, the compiled step would be specialized (and recompiled) for each angle of the cube.
+_no_compile = getattr(getattr(torch, "compiler", None), "disable", lambda fn: fn)  # torch < 2.1 : no compile
+
+@_no_compile
+def tensor_rotate(frame, angle):
+    return rotate(frame, angle, InterpolationMode.BILINEAR) # OR tensor_rotate_fft(frame, angle)
+
 tensor_scale = lambda frame, scale : scaletf(frame, scale) # OR tensor_fft_scale(frame, scale)
 
 # %% Mother class
 
 class Cube_model():
 
-    def __init__(self, nb_frame: int, coro: np.array, psf: None or np.array):
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    def __init__(self, nb_frame: int, coro: np.array, psf: None or np.array, dtype=torch.float32, device=None):
+        # Device of all the tensors of the model (GPU if available, unless set)
+        if device is None: device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.device = torch.device(device)
+        self.dtype = dtype  # dtype of all the tensors of the model (float32, or float64 for more precision)
 
         # -- Constants
         # Sizes
@@ -46,12 +57,14 @@ class Cube_model():
         # Check if deconvolution mode (and pad psf if needed)
         if psf is not None:
             if psf.shape != coro.shape: psf = pad_psf(psf, coro.shape)
-            self.psf = torch.unsqueeze(torch.from_numpy(psf), 0)
+            self.psf = torch.unsqueeze(torch.as_tensor(psf, dtype=dtype, device=self.device), 0)
+            self.psf_fft = tensor_kernel_fft(self.psf)  # psf is constant, FFT computed once
         else:
             self.psf = None
+            self.psf_fft = None
 
         # Coro mask
-        self.coro = torch.unsqueeze(torch.from_numpy(coro), 0)
+        self.coro = torch.unsqueeze(torch.as_tensor(coro, dtype=dtype, device=self.device), 0)
 
     def init_input_estimate(self, Y):
         # If I was a good programmer I would have writen the assertions to prevent bugs here..
@@ -74,47 +87,76 @@ class model_ADI(Cube_model):
              x = circumstellar flux
      """
 
-    def __init__(self, rot_angles: np.array, coro: np.array, psf: None or np.array):
+    def __init__(self, rot_angles: np.array, coro: np.array, psf: None or np.array, dtype=torch.float32,
+                 device=None, rotation="bilinear"):
+        if rotation not in ("bilinear", "fft"): raise ValueError("rotation should be 'bilinear' or 'fft'")
         self.rot_angles = rot_angles
         self.nb_rframe = len(rot_angles)
+        self.rotation = rotation  # "bilinear" (torchvision rotate) or "fft" (flux preserving FFT shears)
 
-        super().__init__(self.nb_rframe, coro, psf)
+        super().__init__(self.nb_rframe, coro, psf, dtype, device)
+        self.fft_rotators = {}
 
-    def forward(self, L: torch.Tensor, x: torch.Tensor, flux=None, fluxR=None) -> torch.Tensor:
-        """ Process forward model  : Y =  ( flux * L + R(x) )  """
+    def get_fft_rotator(self, sgn=1) -> FFTRotator:
+        """ FFT rotator by the angles sgn*rot_angles (rotator(frame, frame_id)).
+        Built at first call and reused : the rot_angles don't change across iterations. """
+        if sgn not in self.fft_rotators:
+            self.fft_rotators[sgn] = FFTRotator(self.frame_shape, sgn * np.asarray(self.rot_angles, dtype=float),
+                                                self.device, self.dtype)
+        return self.fft_rotators[sgn]
 
-        if flux is None: flux = torch.ones(self.nb_rframe - 1).double().to(self.device)
-        if fluxR is None: fluxR = torch.ones(self.nb_rframe - 1).double().to(self.device)
+    def rotate(self, frame: torch.Tensor, frame_id: int, sgn=1) -> torch.Tensor:
+        """ Rotates the frame by sgn*rot_angles[frame_id], with the rotation method of the model """
+        if self.rotation == "fft": return self.get_fft_rotator(sgn)(frame, frame_id)
+        return tensor_rotate(frame, sgn * float(self.rot_angles[frame_id]))
 
-        Y = torch.zeros((self.nb_rframe,) + L.shape).double().to(self.device)
+    def forward(self, L: torch.Tensor, x: torch.Tensor, flux=None, fluxR=None, frames=slice(None)) -> torch.Tensor:
+        """ Process forward model  : Y =  ( flux * L + R(x) )
+        frames : slice of the frames to model (all by default) """
 
-        # First image. No intensity vector
-        Rx = tensor_rotate(ReLU(x), float(self.rot_angles[0]))
-        Y[0] =  ReLU(L + Rx)
+        if flux is None: flux = torch.ones(self.nb_rframe - 1, dtype=self.dtype, device=self.device)
+        if fluxR is None: fluxR = torch.ones(self.nb_rframe - 1, dtype=self.dtype, device=self.device)
 
-        for frame_id in range(1, self.nb_rframe):
-            Rx = tensor_rotate(ReLU(x), float(self.rot_angles[frame_id]))
-            if self.psf is not None: Rx = tensor_conv(Rx, self.psf)
-            Y[frame_id] =  ReLU(flux[frame_id - 1] * (fluxR[frame_id - 1] * ReLU(L) + Rx))
+        frame_ids = range(self.nb_rframe)[frames]
+        Y = torch.zeros((len(frame_ids),) + L.shape, dtype=self.dtype, device=self.device)
+
+        for ii, frame_id in enumerate(frame_ids):
+            Rx = self.rotate(ReLU(x), frame_id)
+
+            # First image. No intensity vector
+            if frame_id == 0:
+                Y[ii] = ReLU(L + Rx)
+                continue
+
+            if self.psf is not None: Rx = tensor_conv_precomputed(Rx, self.psf_fft)
+            Y[ii] =  ReLU(flux[frame_id - 1] * (fluxR[frame_id - 1] * ReLU(L) + Rx))
 
         return Y
 
-    def forward_ADI_reverse(self, L: torch.Tensor, x: torch.Tensor, flux=None, fluxR=None) -> torch.Tensor:
-        """ Process forward model  : Y =  ( flux * R(L) + x) )  """
+    def forward_ADI_reverse(self, L: torch.Tensor, x: torch.Tensor, flux=None, fluxR=None,
+                            frames=slice(None)) -> torch.Tensor:
+        """ Process forward model  : Y =  ( flux * R(L) + x) )
+        frames : slice of the frames to model (all by default) """
 
-        if flux is None: flux = torch.ones(self.nb_rframe - 1).double().to(self.device)
-        if fluxR is None: fluxR = torch.ones(self.nb_rframe - 1).double().to(self.device)
+        if flux is None: flux = torch.ones(self.nb_rframe - 1, dtype=self.dtype, device=self.device)
+        if fluxR is None: fluxR = torch.ones(self.nb_rframe - 1, dtype=self.dtype, device=self.device)
 
-        Y = torch.zeros((self.nb_rframe,) + L.shape).double().to(self.device)
+        frame_ids = range(self.nb_rframe)[frames]
+        Y = torch.zeros((len(frame_ids),) + L.shape, dtype=self.dtype, device=self.device)
 
-        # First image. No intensity vector
-        Rl = tensor_rotate(L, -float(self.rot_angles[0]))
-        Y[0] = ReLU(Rl) + self.coro * ReLU(x)
+        # x is not rotated : same convolved x for all frames
+        Cx = tensor_conv_precomputed(ReLU(x), self.psf_fft) if self.psf is not None else x
 
-        for frame_id in range(1, self.nb_rframe):
-            RL = tensor_rotate(ReLU(L), -float(self.rot_angles[frame_id]))
-            if self.psf is not None: x = tensor_conv(ReLU(x), self.psf)
-            Y[frame_id] = ReLU(flux[frame_id - 1] * (fluxR[frame_id - 1] * ReLU(RL) + ReLU(x)))
+        for ii, frame_id in enumerate(frame_ids):
+
+            # First image. No intensity vector
+            if frame_id == 0:
+                Rl = self.rotate(L, 0, -1)
+                Y[ii] = ReLU(Rl) + self.coro * ReLU(x)
+                continue
+
+            RL = self.rotate(ReLU(L), frame_id, -1)
+            Y[ii] = ReLU(flux[frame_id - 1] * (fluxR[frame_id - 1] * ReLU(RL) + ReLU(Cx)))
 
         return Y
 
@@ -123,16 +165,16 @@ class model_ADI(Cube_model):
 
     def get_Lf(self, L: torch.Tensor, flux=None, fluxR=None, rot=False) -> torch.Tensor:
 
-        Lf = torch.zeros((self.nb_rframe, 1) + self.frame_shape).double().to(self.device)
-        if flux is None: flux = torch.ones(self.nb_rframe - 1).double().to(self.device)
-        if fluxR is None: fluxR = torch.ones(self.nb_rframe - 1).double().to(self.device)
+        Lf = torch.zeros((self.nb_rframe, 1) + self.frame_shape, dtype=self.dtype, device=self.device)
+        if flux is None: flux = torch.ones(self.nb_rframe - 1, dtype=self.dtype, device=self.device)
+        if fluxR is None: fluxR = torch.ones(self.nb_rframe - 1, dtype=self.dtype, device=self.device)
         Lf[0] = ReLU(L)
 
         if rot:
-            Lf[0] = tensor_rotate(ReLU(L), float(self.rot_angles[0]))
+            Lf[0] = self.rotate(ReLU(L), 0)
             for frame_id in range(1, self.nb_rframe):
                 Lf[frame_id] = fluxR[frame_id - 1] * flux[frame_id - 1] * \
-                               tensor_rotate(ReLU(L), float(self.rot_angles[frame_id]))
+                               self.rotate(ReLU(L), frame_id)
             return Lf
 
         else :
@@ -144,12 +186,12 @@ class model_ADI(Cube_model):
     def get_Rx(self, x: torch.Tensor, flux=None, inverse=False) -> torch.Tensor:
 
         sgn = -1 if inverse else 1
-        Rx = torch.zeros((self.nb_rframe, 1) + self.frame_shape).double().to(self.device)
-        if flux is None: flux = torch.ones(self.nb_rframe - 1).double().to(self.device)
-        Rx[0] = tensor_rotate(ReLU(x), sgn*float(self.rot_angles[0]))
+        Rx = torch.zeros((self.nb_rframe, 1) + self.frame_shape, dtype=self.dtype, device=self.device)
+        if flux is None: flux = torch.ones(self.nb_rframe - 1, dtype=self.dtype, device=self.device)
+        Rx[0] = self.rotate(ReLU(x), 0, sgn)
 
         for frame_id in range(1, self.nb_rframe):
-            Rx[frame_id] =  ReLU(flux[frame_id - 1] * tensor_rotate(ReLU(x), sgn*float(self.rot_angles[frame_id])))
+            Rx[frame_id] =  ReLU(flux[frame_id - 1] * self.rotate(ReLU(x), frame_id, sgn))
 
         return Rx
 
@@ -166,24 +208,25 @@ class model_ASDI(Cube_model):
              k, j id of spectral/angular diversity
      """
 
-    def __init__(self, rot_angles: np.array, scales: np.array, coro: np.array, psf: None or np.array):
+    def __init__(self, rot_angles: np.array, scales: np.array, coro: np.array, psf: None or np.array,
+                 dtype=torch.float32, device=None):
 
         self.scales = scales
         self.rot_angles = rot_angles
         self.nb_rframe = len(rot_angles)
         self.nb_sframe = len(scales)
 
-        super().__init__(self.nb_rframe, coro, psf)
+        super().__init__(self.nb_rframe, coro, psf, dtype, device)
 
 
     def forward(self, L: torch.Tensor, x: torch.Tensor, flux=None, fluxR=None) -> torch.Tensor:
         """ Process forward model  : Y =  ( flux * L + R(x) )  """
 
         # TODO flux can also vary between spectraly diverse frames ??
-        if flux is None: flux = torch.ones(self.nb_rframe - 1).double().to(self.device)
-        if fluxR is None: fluxR = torch.ones(self.nb_rframe - 1).double().to(self.device)
+        if flux is None: flux = torch.ones(self.nb_rframe - 1, dtype=self.dtype, device=self.device)
+        if fluxR is None: fluxR = torch.ones(self.nb_rframe - 1, dtype=self.dtype, device=self.device)
 
-        Y = torch.zeros((self.nb_rframe, self.nb_sframe) + L.shape).double().to(self.device)
+        Y = torch.zeros((self.nb_rframe, self.nb_sframe) + L.shape, dtype=self.dtype, device=self.device)
 
         # First image. No intensity vector
         Rx = tensor_rotate(ReLU(x), float(self.rot_angles[0]))
@@ -194,7 +237,7 @@ class model_ASDI(Cube_model):
             for id_s in range(0, self.nb_sframe):
                 Rx = tensor_rotate(ReLU(x), float(self.rot_angles[id_r]))
                 Sl = tensor_scale(ReLU(L), float(self.scales[id_s]))
-                if self.psf is not None: Rx = tensor_conv(Rx, self.psf)
+                if self.psf is not None: Rx = tensor_conv_precomputed(Rx, self.psf_fft)
                 Y[id_r, id_s] = flux[id_r - 1] * ( fluxR[id_r - 1] * Sl + Rx )
 
         return Y
@@ -212,21 +255,21 @@ class model_SDI(Cube_model):
              k, j id of spectral/angular diversity
      """
 
-    def __init__(self, scales: np.array, coro: np.array, psf: None or np.array):
+    def __init__(self, scales: np.array, coro: np.array, psf: None or np.array, dtype=torch.float32, device=None):
 
         self.scales = scales
         self.nb_sframe = len(scales)
-        super().__init__(self.nb_sframe, coro, psf)
+        super().__init__(self.nb_sframe, coro, psf, dtype, device)
 
 
 
     def forward(self, L: torch.Tensor, x: torch.Tensor, flux=None, fluxR=None) -> torch.Tensor:
         """ Process forward model  : Y =  ( flux * L + R(x) )  """
 
-        if flux is None: flux = torch.ones(self.nb_sframe - 1).double().to(self.device)
-        if fluxR is None: fluxR = torch.ones(self.nb_sframe - 1).double().to(self.device)
+        if flux is None: flux = torch.ones(self.nb_sframe - 1, dtype=self.dtype, device=self.device)
+        if fluxR is None: fluxR = torch.ones(self.nb_sframe - 1, dtype=self.dtype, device=self.device)
 
-        Y = torch.zeros((self.nb_sframe, ) + L.shape).double().to(self.device)
+        Y = torch.zeros((self.nb_sframe, ) + L.shape, dtype=self.dtype, device=self.device)
 
         # First image. No intensity vector
         Sl = tensor_scale(ReLU(L), 1/float(self.scales[0]))
@@ -251,6 +294,12 @@ class Gauss_2D():
         self.indices   = torch.from_numpy(np.indices(img.shape))
         x, y = (self.indices).numpy()
 
+        # Centred grids and their products do not depend on the parameters : computed once,
+        # not at each evaluation of the model by the minimizer
+        self.xdiff, self.ydiff = self.indices - self.cent
+        xdiff, ydiff = x - self.cent, y - self.cent
+        xdiff_sq, ydiff_sq, xydiff = xdiff ** 2, ydiff ** 2, xdiff * ydiff
+
         from scipy.optimize import (fmin_slsqp, minimize) # SLSQP, not very robust, minimiz truct better
         from scipy.optimize import NonlinearConstraint
 
@@ -268,6 +317,8 @@ class Gauss_2D():
         imgT = torch.from_numpy(img)
         cons_max = img
         cons_min = 0
+        mask_cons_max = mask * (1 + exceeding) * cons_max
+        mask_abs_img = mask * abs(img)
 
         def model(param):
             amplitude, x_stddev, y_stddev, theta = param
@@ -277,18 +328,15 @@ class Gauss_2D():
             sin2t = np.sin(2. * theta)
             xstd2 = x_stddev ** 2
             ystd2 = y_stddev ** 2
-            xdiff = x - self.cent
-            ydiff = y - self.cent
             a = 0.5 * ((cost2 / xstd2) + (sint2 / ystd2))
             b = 0.5 * ((sin2t / xstd2) - (sin2t / ystd2))
             c = 0.5 * ((sint2 / xstd2) + (cost2 / ystd2))
 
-            return np.abs(amplitude) * np.exp(-((a * xdiff ** 2) + (b * xdiff * ydiff) +
-                                              (c * ydiff ** 2)))
+            return np.abs(amplitude) * np.exp(-((a * xdiff_sq) + (b * xydiff) + (c * ydiff_sq)))
 
         def constrain_max(param):
             """Condition : cons_max - model(param) >= 0 -> cons_max >= model(param)"""
-            return mask*((1+exceeding)*cons_max - model(param))
+            return mask_cons_max - mask * model(param)
 
         def constrain_min(param):
             """Condition: model(param) - cons_min >= 0 -> cons_min <= model(param)"""
@@ -303,7 +351,7 @@ class Gauss_2D():
 
         def objective_function(param):
             """Distance to the model"""
-            return np.linalg.norm(mask*(abs(img) - model(param)), 2)**2
+            return np.linalg.norm(mask_abs_img - mask * model(param), 2)**2
 
         res = fit_2dgaussian(img, full_output=True, debug=False)
         amplitude, theta  = res['amplitude'][0], res['theta'][0]
@@ -345,7 +393,6 @@ class Gauss_2D():
 
     def generate_k(self, amplitude=None, x_stddev=None, y_stddev=None, theta=None):
 
-        x, y = self.indices
         amplitude_k = amplitude if amplitude is not None else self.amplitude
         x_stddev_k  = x_stddev  if x_stddev  is not None else self.x_stddev
         y_stddev_k  = y_stddev  if y_stddev  is not None else self.y_stddev
@@ -356,8 +403,7 @@ class Gauss_2D():
         sin2t = torch.sin(2. * theta_k)
         xstd2 = x_stddev_k ** 2
         ystd2 = y_stddev_k ** 2
-        xdiff = x - self.cent
-        ydiff = y - self.cent
+        xdiff, ydiff = self.xdiff, self.ydiff
         a = 0.5 * ((cost2 / xstd2) + (sint2 / ystd2))
         b = 0.5 * ((sin2t / xstd2) - (sin2t / ystd2))
         c = 0.5 * ((sint2 / xstd2) + (cost2 / ystd2))
@@ -366,15 +412,13 @@ class Gauss_2D():
                                     (c * ydiff ** 2)))
 
     def generate(self):
-        x, y = self.indices
 
         cost2 = torch.cos(self.theta) ** 2
         sint2 = torch.sin(self.theta) ** 2
         sin2t = torch.sin(2. * self.theta)
         xstd2 = self.x_stddev ** 2
         ystd2 = self.y_stddev ** 2
-        xdiff = x - self.cent
-        ydiff = y - self.cent
+        xdiff, ydiff = self.xdiff, self.ydiff
         a = 0.5 * ((cost2 / xstd2) + (sint2 / ystd2))
         b = 0.5 * ((sin2t / xstd2) - (sin2t / ystd2))
         c = 0.5 * ((sint2 / xstd2) + (cost2 / ystd2))
@@ -14,12 +14,13 @@ ______________________________
 
 # -- For file management -- #
 from vip_hci.fits import write_fits
-from os import makedirs, remove, rmdir
+from os import makedirs, cpu_count
 from os.path import isdir
 
 # -- Algo and science model -- #
 from mustard.model import model_ADI, model_ASDI, model_SDI
-from mustard.algo import sobel_tensor_conv, convert_to_mask, radial_profil, res_non_convexe, create_radial_prof_matirx
+from mustard.algo import sobel_sq_tensor_conv, convert_to_mask, radial_profil, res_non_convexe, create_radial_prof_matirx
+from mustard.algo import tensor_cube_derotate, tensor_frame_derotate
 
 # Numpy operators                          
 from vip_hci.preproc import cube_derotate, frame_rotate,cube_rescaling_wavelengths, cube_crop_frames
@@ -29,14 +30,15 @@ from torchvision.transforms.functional import InterpolationMode
 
 # -- Loss functions -- #
 import torch.optim as optim
+from torch.utils.checkpoint import checkpoint
 from torch import sum as tsum
 from torch.nn import ReLU as relu_constr
 
 # -- Misk -- #
 import torch
 import numpy as np
-from mustard.utils import circle, iter_to_gif, print_iter
-from copy import deepcopy
+from mustard.utils import circle, sq_radius_map, iter_to_gif, print_iter
+from concurrent.futures import ThreadPoolExecutor
 
 # -- For verbose -- #
 from datetime import datetime
@@ -65,9 +67,8 @@ ReLU = relu_constr()
 
 def loss_ratio(Ractiv: int or bool, R1: float, R2: float, L: float) -> tuple:
     """ Compute Regul weight over data attachment terme """
-    return tuple(np.array((1, 100 / L)) * (L - Ractiv * (abs(R1) + abs(R2)))) + \
-           tuple(np.array((1, 100 / L)) * abs(R1)) + \
-           tuple(np.array((1, 100 / L)) * abs(R2))
+    L_net = L - Ractiv * (abs(R1) + abs(R2))
+    return L_net, L_net * 100 / L, abs(R1), abs(R1) * 100 / L, abs(R2), abs(R2) * 100 / L
 
 
 # %% ------------------------------------------------------------------------
@@ -76,7 +77,8 @@ class mustard_estimator:
     """ MUSTARD Algorithm main class  """
 
     def __init__(self, science_data: np.ndarray, angles: np.ndarray, scale=None, coro=6, pupil="edge",
-                 psf=None, hid_mask=None, Badframes=None, savedir='./', ref=None):
+                 psf=None, hid_mask=None, Badframes=None, savedir='./', ref=None,
+                 dtype=torch.float32, device=None, rotation="bilinear"):
         """
         Initialisation of estimator object
 
@@ -111,9 +113,24 @@ class mustard_estimator:
 
         savedir : str
             Path for outputs
+
+        dtype : torch.dtype
+            dtype of the tensors of the estimation. Default is torch.float32 (twice the throughput and half
+            the memory of float64). Set torch.float64 for more precision.
+
+        device : str or torch.device or None
+            Device of the estimation (ex : "cpu", "cuda", "cuda:1"). The cube, masks, models and estimated variables
+            are kept on it during the whole minimization. If None, the GPU is used when available.
+
+        rotation : {"bilinear", "fft"}
+            (ADI mode) Rotation method of the forward models. "bilinear" is the interpolated torchvision rotation.
+            "fft" rotates with FFT shears (flux preserving, slower), the shear phases of the angles of the cube
+            are computed once and reused at each iteration. Default is "bilinear".
         """
 
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        if device is None: device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.device = torch.device(device)
+        self.dtype = dtype
         # -- Create model and define constants --
 
         if Badframes is not None:
@@ -151,7 +168,7 @@ class mustard_estimator:
             self.nb_frame = science_data.shape[0]
             if science_data.shape[0] != len(angles) or science_data.shape[1] != len(scale):
                 raise "Length of scales does not match the size of the science-data cube !"
-            self.model = model_ASDI(rot_angles, scale, self.coro, psf)
+            self.model = model_ASDI(rot_angles, scale, self.coro, psf, dtype, self.device)
         
         elif angles is None and scale is None:
             # User forgot something..
@@ -162,38 +179,41 @@ class mustard_estimator:
            self.shape = science_data[0].shape
            self.nb_frame = science_data.shape[0]  
            if self.nb_frame != len(scale) : raise "Length of scales does not match the size of the science-data cube !"
-           self.model = model_SDI(scale, self.coro, psf)
+           self.model = model_SDI(scale, self.coro, psf, dtype, self.device)
 
         elif angles is not None:
             # Mode ADI
             self.shape = science_data[0].shape
             self.nb_frame = science_data.shape[0]   
             if self.nb_frame != len(angles) : raise "Length of angles does not match the size of the science-data cube !"
-            self.model = model_ADI(rot_angles, self.coro, psf)
+            self.model = model_ADI(rot_angles, self.coro, psf, dtype, self.device, rotation)
 
 
         # Coro and pupil masks
+        # (squared distance to the center computed once, shared by all the circles : disk(r) == circle(shape, r))
+        rr = sq_radius_map(self.shape)
+        disk = lambda r: (rr < r ** 2).astype(float)
         pupilR = pupil
         if pupil is None:
             pupil = np.ones(self.shape)
         elif pupil == "edge":
-            pupil = circle(self.shape, self.shape[0] / 2)
-            pupilR = circle(self.shape, self.shape[0] / 2 - 2)
+            pupil = disk(self.shape[0] / 2)
+            pupilR = disk(self.shape[0] / 2 - 2)
         elif isinstance(pupil, (int, float)):
-            pupil = circle(self.shape, pupil)
-            pupilR = circle(self.shape, pupilR - 2)
+            pupil = disk(pupil)
+            pupilR = disk(pupilR - 2)
         else:
             raise ValueError("Invalid pupil key argument. Possible values : {float/int, None, 'edge'}")
 
         # Pup_bgk used to compute background intensity value using the outer annulus of 15 pixels
-        self.pup_bkg = circle(self.shape, self.shape[0]/2) - circle(self.shape, self.shape[0]/2-15)
+        self.pup_bkg = disk(self.shape[0]/2) - disk(self.shape[0]/2-15)
 
         # Coro mask + coro mask for regul (bigger to avoid border effect)
         if coro is None: coro = 3
         self.coro_siz = coro
-        self.coro = (1 - circle(self.shape, coro)) * pupil
-        self.coroR = (1 - circle(self.shape, coro+2)) * pupilR
-        self.final_mask = deepcopy(self.coro)
+        self.coro = (1 - disk(coro)) * pupil
+        self.coroR = (1 - disk(coro+2)) * pupilR
+        self.final_mask = self.coro.copy()
         
         # For specific corrected region. 
         if hid_mask is not None:
@@ -202,10 +222,11 @@ class mustard_estimator:
 
         
         # Will be filled with weight if anf_weight option is activated
-        self.ang_weight = torch.from_numpy(np.ones(self.nb_frame).reshape((self.nb_frame, 1, 1, 1))).double()
+        self.ang_weight = torch.ones((self.nb_frame, 1, 1, 1), dtype=self.dtype, device=self.device)
 
-        self.coro = torch.from_numpy(self.coro).double().to(self.device)
-        self.coroR = torch.from_numpy(self.coroR).double().to(self.device)
+        self.coro_np = self.coro  # Host copy for the numpy results (no device round-trip)
+        self.coro = torch.from_numpy(self.coro).to(self.device, self.dtype)
+        self.coroR = torch.from_numpy(self.coroR).to(self.device, self.dtype)
 
         # -- Configure regularization (can be change later, this is defaults parameters)
         self.config = ["smooth", None, 'No' if psf is None else 'With', 'no', 'Both L and X']
@@ -214,7 +235,7 @@ class mustard_estimator:
         self.configR3(mode="smooth")
 
         # Mask used for initalization.
-        self.ref_mask = torch.Tensor((1 - circle(self.shape, coro + 2)) * circle(self.shape, self.shape[0] / 2 - 2))
+        self.ref_mask = torch.Tensor((1 - disk(coro + 2)) * disk(self.shape[0] / 2 - 2))
         self.ref_mask_siz = [coro + 2, self.shape[0] / 2 - 2]
 
         # Itilisization of varaibles.
@@ -222,21 +243,29 @@ class mustard_estimator:
         self.last_iter = None; # (X_k, L_k, +option_k)
         self.first_iter = None; # (X_0, L_0, +option_0)
         self.final_estim = None # (X_est, L_est, +option_est)
+        self.model_cubes = {}  # way : (last_iter, model cube of last_iter), see get_model_cube
         
         # (todelete)
         self.ambiguities = None;
         self.speckles = None; 
-        self.science_data_ori = None  
+        self.science_data_ori = None  # Raw cube, kept once a median subtraction is applied (see estimate med_sub)
+        self.med_sub = False
         self.pup_bkg_id = torch.tensor(np.array(np.where(self.pup_bkg == 1)), dtype=torch.long)
         self.science_data[np.where(self.science_data == 0)] = np.finfo(float).eps
 
+        # Science cube (and its derotation) on the device, converted once and reused by estimate and the getters
+        self.science_data_t = torch.from_numpy(np.ascontiguousarray(self.science_data)).to(self.device, self.dtype)
+        self.science_data_derot = None  # Host (float64) derotated cube, see get_science_data_derot
+        self.science_data_derot_t = None
+
     # (todelete)
     def compute_bkg(self, X):
         return torch.median(X[self.pup_bkg_id])
 
     def estimate(self, w_r=0.03, w_r2=0.03, w_r3=0.01, w_pcent=True, estimI="Both", med_sub=False, weighted_rot=True,
                  w_way=(0, 1), maxiter=10, gtol=1e-10, kactiv=0, kdactiv=None, save="./", suffix='', gif=False,
-                 verbose=False, history=True, init_maxL=False, mask_L=None):
+                 verbose=False, history=True, init_maxL=False, mask_L=None, init_torch=False, n_jobs=1,
+                 compile_step=False, checkpointing=False, line_search=None):
         """ Resole the minimization of probleme neo-mayo
             The first step with pca aim to find a good initialisation
             The second step process to the minimization
@@ -248,6 +277,31 @@ class mustard_estimator:
             if True, all ambiguities will be set to L : stellar halo/speakles map. (no recommended)
             Default is False.
 
+        init_torch: bool
+            (ADI mode) if True, the max common initialisation is computed with torch on the estimator device
+            (batched bilinear rotations) instead of vip/numpy. Avoid cube transfers between numpy and the GPU.
+            Default is False.
+
+        n_jobs: int or None
+            Number of threads used for the frame rotations of the max common initialisations (numpy versions).
+            If None, use all the cpus. Default is 1.
+
+        compile_step: bool or str
+            if True, the loss of the minimizer step (models + regularizations) is compiled with torch.compile
+            (fused kernels, less python overhead). A str is used as the torch.compile mode (ex : "reduce-overhead",
+            cuda graphs). Compilation is done before the minimization loop. Default is False.
+            (!) The bilinear rotations (torchvision, one python float angle per frame) are kept out of the compiled
+            graph and run eagerly, otherwise the step would be recompiled for each angle of the cube.
+
+        checkpointing: bool
+            if True, the intermediate results of the forward models are not kept for the backward but recomputed
+            (torch.utils.checkpoint). Less memory for large cubes, at the cost of computing the models twice.
+            (ADI : frames are modeled by chunks of ~sqrt(nb_frame), one chunk in memory at a time). Default is False.
+
+        line_search: str or None
+            Line search of the LBFGS optimizer (None or "strong_wolfe"). A line search costs more evaluations per
+            step but can need fewer steps on ill-conditioned problems. Default is None (fixed step).
+
         w_r : float
             Weight regularization, hyperparameter to control R1 regularization (smooth regul)
 
@@ -331,31 +385,48 @@ class mustard_estimator:
         if isinstance(self.model, model_ADI) and weighted_rot:
             self.config[3] = "with"
             ang_weight = compute_rot_weight(self.model.rot_angles)
-            self.ang_weight = torch.from_numpy(ang_weight.reshape((self.nb_frame, 1, 1, 1))).double().to(self.device)
+            self.ang_weight = torch.as_tensor(ang_weight, dtype=self.dtype, device=self.device).view(-1, 1, 1, 1)
         elif isinstance(self.model, model_ASDI):
             if weighted_rot:
                 self.config[3] = "with"
                 ang_weight = compute_rot_weight(self.model.rot_angles)
                 self.ang_weight = torch.from_numpy(ang_weight.tiles(
-                    (self.model.nb_rframe, self.model.nb_sframe, 1, 1))).double().to(self.device)
+                    (self.model.nb_rframe, self.model.nb_sframe, 1, 1))).to(self.device, self.dtype)
             else:
-                self.ang_weight = torch.from_numpy(
-                    np.ones((self.nb_frame, self.model.nb_sframe, 1, 1, 1))).double().to(self.device)
+                self.ang_weight = torch.ones((self.nb_frame, self.model.nb_sframe, 1, 1, 1), dtype=self.dtype,
+                                             device=self.device)
         elif self.ang_weight is None:
-            self.ang_weight = torch.from_numpy(np.ones((self.nb_frame, 1, 1, 1))).double().to(self.device)
+            self.ang_weight = torch.ones((self.nb_frame, 1, 1, 1), dtype=self.dtype, device=self.device)
 
         # When pixels by their variances. Can be shut down.
-        temporal_var = np.var(self.science_data, axis=0)
-        temporal_var *= 1 / np.max(temporal_var)
-        self.var_pond = 1  # torch.unsqueeze(torch.from_numpy(1 / temporal_var), 0).double().to(self.device)
+        # temporal_var = np.var(self.science_data, axis=0)
+        # temporal_var *= 1 / np.max(temporal_var)
+        self.var_pond = 1  # torch.unsqueeze(torch.from_numpy(1 / temporal_var), 0).to(self.device, self.dtype)
 
         # Combine static masks/weights into one signle weight mask.
-        self.weight = self.coro * self.var_pond * self.ang_weight
+        # (var_pond is 1 when the temporal weighting is not used, ang_weight are ones without weighted_rot :
+        # coro alone broadcasts against the cube)
+        self.weight = self.coro if not weighted_rot else self.coro * self.ang_weight
+        if not (isinstance(self.var_pond, int) and self.var_pond == 1): self.weight = self.weight * self.var_pond
+        sqrt_weight = torch.sqrt(self.weight)  # Losses are computed as squared norms of weighted residuals
 
         # ______________________________________
         # Define constantes and convert arry to tensor
 
-        # Med sub
+        # Med sub (median of each frame inside the coronagraph mask, one broadcast over the cube).
+        # Always computed from the raw cube (science_data_ori) : repeated calls give the same cube.
+        # Device tensors are updated to match.
+        if med_sub != self.med_sub:
+            if self.science_data_ori is None: self.science_data_ori = self.science_data
+            if med_sub:
+                meds = np.median(self.science_data_ori[..., self.coro_np > 0], axis=-1)
+                self.science_data = np.maximum(self.science_data_ori - meds[..., None, None], np.finfo(float).eps)
+            else:
+                self.science_data = self.science_data_ori
+            self.science_data_t.copy_(torch.from_numpy(self.science_data))
+            self.science_data_derot, self.science_data_derot_t = None, None
+            self.med_sub = med_sub
+
         if mask_L is not None:
             if len(mask_L) == 2 and isinstance(mask_L[0], int) and isinstance(mask_L[1], int):
                 self.ref_mask = torch.Tensor(circle(self.shape, mask_L[1]) - circle(self.shape, mask_L[0]))
@@ -364,16 +435,15 @@ class mustard_estimator:
                 raise "mask_L should be an object that contain two int"
 
         if isinstance(self.model, model_ASDI):
-            science_data = torch.unsqueeze(torch.from_numpy(self.science_data), 2).double().to(self.device)
+            science_data = torch.unsqueeze(self.science_data_t, 2)
         else:
-            science_data = torch.unsqueeze(torch.from_numpy(self.science_data), 1).double().to(self.device)
+            science_data = torch.unsqueeze(self.science_data_t, 1)
 
         # __________________________________
         # Initialisation with max common
 
         if self.L0x0 is not None and w_way[1] == 0:
-            science_data_derot_np = cube_derotate(self.science_data, self.model.rot_angles)
-            science_data_derot = torch.unsqueeze(torch.from_numpy(science_data_derot_np), 1).double().to(self.device)
+            science_data_derot = torch.unsqueeze(self.get_science_data_derot_t(), 1)
             if verbose: print("Load initialization")
             L0, X0 = self.L0x0[0], self.L0x0[1]
         else:
@@ -382,19 +452,29 @@ class mustard_estimator:
 
                 if verbose: print("Mode ADI : Max common init in progress... ")
 
-                if self.nb_ref == 0 :
-                    science_data_derot_np = cube_derotate(self.science_data, self.model.rot_angles)
-                    science_data_derot = torch.unsqueeze(torch.from_numpy(science_data_derot_np), 2).double()
-
-                    med_L = np.median(self.science_data, axis=0).clip(min=0)
-                    R_fr = science_data_derot_np - cube_derotate(np.tile(med_L, (self.nb_frame, 1, 1)),
-                                                                 -self.model.rot_angles)
+                if self.nb_ref == 0 and init_torch:
+                    science_data_derot, L0, X0 = max_common_init_torch(science_data[:, 0], self.model.rot_angles,
+                                                                       self.ref_mask)
+                    science_data_derot = torch.unsqueeze(science_data_derot, 1)
+                    self.L0x0 = L0.cpu().numpy(), X0.cpu().numpy()
+
+                elif self.nb_ref == 0 :
+                    science_data_derot_np = derotate_frames(self.science_data, self.model.rot_angles, n_jobs)
+                    self.science_data_derot = science_data_derot_np
+                    self.science_data_derot_t = torch.as_tensor(science_data_derot_np, dtype=self.dtype,
+                                                                device=self.device)
+                    science_data_derot = torch.unsqueeze(self.science_data_derot_t, 1)
+
+                    med_L = median_frames(self.science_data)
+                    np.clip(med_L, 0, None, out=med_L)
+                    R_fr = derotate_and_subtract(science_data_derot_np, med_L, -self.model.rot_angles, n_jobs)
                     res_R = np.mean(R_fr, axis=0).clip(min=0)
                     del R_fr
                     # self.L0x0 = res.clip(min=0), np.mean(R_fr, axis=0).clip(min=0)
 
-                    med_R = np.median(science_data_derot_np, axis=0).clip(min=0)
-                    L_fr = self.science_data - cube_derotate(np.tile(med_R, (self.nb_frame, 1, 1)), self.model.rot_angles)
+                    med_R = median_frames(science_data_derot_np)
+                    np.clip(med_R, 0, None, out=med_R)
+                    L_fr = derotate_and_subtract(self.science_data, med_R, self.model.rot_angles, n_jobs)
                     res_L = np.mean(L_fr, axis=0).clip(min=0)
                     del L_fr
                     # self.L0x0 = np.mean(L_fr, axis=0).clip(min=0), res.clip(min=0)
@@ -409,24 +489,26 @@ class mustard_estimator:
                     L0 = med_L * (1 - self.ref_mask.numpy()) + res_L * self.ref_mask.numpy()
                     X0 = med_R * self.ref_mask.numpy() + res_R * (1 - self.ref_mask.numpy())
 
+                    self.L0x0 = L0, X0
+                    del res_R, res_L, med_R, med_L
+
                 else :
 
-                    science_data_derot_np = cube_derotate(self.science_data[:-self.nb_ref], self.model.rot_angles)
+                    science_data_derot_np = derotate_frames(self.science_data[:-self.nb_ref], self.model.rot_angles,
+                                                            n_jobs)
                     ref_mean = np.mean(self.science_data[:self.nb_ref])
 
-                    X0 = np.mean(science_data_derot_np-ref_mean) #+ res_R.clip(min=0)*(1 - self.ref_mask.numpy())
-                    empty_sd = self.science_data[:-self.nb_ref] - cube_derotate(np.tile(X0, (self.nb_frame, 1, 1)), self.model.rot_angles)
+                    X0 = np.mean(science_data_derot_np) - ref_mean #+ res_R.clip(min=0)*(1 - self.ref_mask.numpy())
                     L0 = med_L.clip(min=0)*(1 - self.ref_mask.numpy()) + res_L*self.ref_mask.numpy()
 
-                self.L0x0 = L0, X0
-                del res_R, res_L, med_R, med_L
+                    self.L0x0 = L0, X0
 
             if isinstance(self.model, model_ASDI):
                 if verbose: print("Mode ASDI : Max common init in progress... ")
                 science_data_derot_np = np.ndarray(self.science_data.shape)
                 for channel in range(self.model.nb_sframe):
-                    science_data_derot_np[:, channel] = cube_derotate(self.science_data[:, channel],
-                                                                      self.model.rot_angles)
+                    science_data_derot_np[:, channel] = derotate_frames(self.science_data[:, channel],
+                                                                        self.model.rot_angles, n_jobs)
                 for angles in range(self.model.nb_rframe):
                     tmp_derot, res, _, _, _, _ = cube_rescaling_wavelengths(science_data_derot_np[angles, :],
                                                                             self.model.scales, full_output=True)
@@ -440,9 +522,9 @@ class mustard_estimator:
                 elif init_maxL:
                     res = np.mean(self.science_data, axis=(0, 1))
                     L_fr = np.zeros(science_data_derot_np.shape)
-                    res_cube = np.tile(res, (self.model.nb_rframe, self.model.nb_sframe, 1, 1))
-                    for channel in range(self.model.nb_sframe):
-                        L_fr[:, channel] = cube_derotate(res_cube[:, channel], -self.model.rot_angles)
+                    res_cube = np.broadcast_to(res, (self.model.nb_rframe, self.model.nb_sframe) + res.shape)
+                    # Same frame in each channel : rotated once, then copied to all channels
+                    L_fr[:] = derotate_frames(res_cube[:, 0], -self.model.rot_angles, n_jobs)[:, None]
                     for angles in range(self.model.nb_rframe):
                         tmp_derot, _, _, _, _, _ = cube_rescaling_wavelengths(res_cube[angles, :],
                                                                               self.model.scales, full_output=True)
@@ -452,18 +534,16 @@ class mustard_estimator:
                 else:
                     res = np.mean(science_data_derot_np, axis=(0, 1))
                     R_fr = np.zeros(science_data_derot_np.shape)
-                    res_cube = np.tile(res, (self.model.nb_rframe, self.model.nb_sframe, 1, 1))
-                    for channel in range(self.model.nb_sframe):
-                        R_fr[:, channel] = cube_derotate(res_cube[:, channel],
-                                                         - self.model.rot_angles)
+                    res_cube = np.broadcast_to(res, (self.model.nb_rframe, self.model.nb_sframe) + res.shape)
+                    R_fr[:] = derotate_frames(res_cube[:, 0], -self.model.rot_angles, n_jobs)[:, None]
                     for angles in range(self.model.nb_rframe):
                         tmp_derot, _, _, _, _, _ = cube_rescaling_wavelengths(res_cube[angles, :],
                                                                               1 / self.model.scales, full_output=True)
                         if R_fr.shape[-1] > self.shape[0]: R_fr[angles, :] = cube_crop_frames(tmp_derot, self.shape[0])
                     R_lr = self.science_data - R_fr
                     self.L0x0 = np.mean(R_lr, axis=(0, 1)), res.clip(min=0)
-                science_data_derot = torch.unsqueeze(torch.from_numpy(science_data_derot_np), 2).double().to(
-                    self.device)
+                science_data_derot = torch.unsqueeze(torch.from_numpy(science_data_derot_np), 2).to(
+                    self.device, self.dtype)
 
                 if isinstance(self.model, model_SDI):
                     if verbose: print("Mode SDI : Max common init in progress... ")
@@ -478,36 +558,36 @@ class mustard_estimator:
                     elif init_maxL:
                         res = np.mean(science_data_derot_np, axis=0)
                         L_fr, L_mean, _, _, _, _ = cube_rescaling_wavelengths(
-                            np.tile((res), (self.model.nb_sframe, 1, 1)), 1 / self.model.scales, full_output=True)
+                            np.broadcast_to(res, (self.model.nb_sframe,) + res.shape), 1 / self.model.scales, full_output=True)
                         if L_fr.shape[-1] > self.shape[0]: L_fr = cube_crop_frames(L_fr, self.shape[0])
                         write_fits("L_fr", L_fr)
                         L_lr = (science_data_derot_np - L_fr).clip(min=0)
                         write_fits("L_lr", L_lr)
                         self.L0x0 = np.mean(L_lr, axis=0), res.clip(min=0)
                     else:
-                        res = np.median(self.science_data, axis=0)
+                        res = median_frames(self.science_data)
                         R_fr, R_mean, _, _, _, _ = cube_rescaling_wavelengths(
-                            np.tile((res).clip(min=0), (self.model.nb_sframe, 1, 1)), self.model.scales,
+                            np.broadcast_to(res.clip(min=0), (self.model.nb_sframe,) + res.shape), self.model.scales,
                             full_output=True)
                         if R_fr.shape[-1] > self.shape[0]:  R_fr = cube_crop_frames(R_fr, self.shape[0])
                         write_fits("R_fr", R_fr)
                         R_lr = (science_data_derot_np - R_fr).clip(min=0)
                         write_fits("R_lr", R_lr)
                         self.L0x0 = np.mean(R_lr, axis=0), res.clip(min=0)
-                    science_data_derot = torch.unsqueeze(torch.from_numpy(science_data_derot_np), 1).double().to(
-                        self.device)
+                    science_data_derot = torch.unsqueeze(torch.from_numpy(science_data_derot_np), 1).to(
+                        self.device, self.dtype)
 
         self.get_initialisation(save=True)
-        if self.config[0] == "peak_preservation": self.xmax = np.max(X0)
+        if self.config[0] == "peak_preservation": self.xmax = np.max(self.L0x0[1])
 
         # __________________________________
         # Initialisation with max common
 
-        L0 = torch.unsqueeze(torch.from_numpy(L0), 0).double().to(self.device)
-        X0 = torch.unsqueeze(torch.from_numpy(X0), 0).double().to(self.device)
-        flux_0 = torch.ones(self.model.nb_frame - 1).double().to(self.device)
-        fluxR_0 = torch.ones(self.model.nb_frame - 1).double().to(self.device)
-        ref_amp_0 = torch.Tensor([1])
+        L0 = torch.unsqueeze(torch.as_tensor(L0, dtype=self.dtype, device=self.device), 0)
+        X0 = torch.unsqueeze(torch.as_tensor(X0, dtype=self.dtype, device=self.device), 0)
+        flux_0 = torch.ones(self.model.nb_frame - 1, dtype=self.dtype, device=self.device)
+        fluxR_0 = torch.ones(self.model.nb_frame - 1, dtype=self.dtype, device=self.device)
+        ref_amp_0 = torch.ones(1, dtype=self.dtype, device=self.device)
 
         fluxR_0[self.nb_ref:] = 0
 
@@ -525,9 +605,10 @@ class mustard_estimator:
             Y0 = self.model.forward(L0, X0, flux_0, fluxR_0) if w_way[0] else 0
             Y0_reverse = self.model.forward_ADI_reverse(L0, X0, flux_0, fluxR_0) if w_way[1] else 0
 
-            loss0 = w_way[0] * torch.sum(self.weight * (Y0 - science_data) ** 2) + \
-                    w_way[1] * torch.sum(self.weight * (Y0_reverse - science_data_derot) ** 2)
+            loss0 = (w_way[0] * weighted_sq_sum(sqrt_weight, Y0, science_data) if w_way[0] else 0) + \
+                    (w_way[1] * weighted_sq_sum(sqrt_weight, Y0_reverse, science_data_derot) if w_way[1] else 0)
 
+            reg1 = reg2 = reg3 = None  # Regularizations at init : computed once, reused for the loss
             if w_pcent and Ractiv:  # Auto hyperparameters
                 reg1 = self.regul1(X0, L0)
                 w_r = w_rp[0] * loss0 / reg1 if w_rp[0] and reg1 > 0 else 0
@@ -543,9 +624,13 @@ class mustard_estimator:
                                       "Activation is set to iteration n°2. ")
                     kactiv = 2
 
-            R1_0 =  w_r * self.regul1(X0, L0) if w_r * Ractiv else 0
-            R2_0 = Ractiv * w_r2 * self.regul2(X0, L0, self.mask, ref_amp_0)
-            R3_0 = w_r3 * self.regul3(X0, L0) if w_r * Ractiv else 0
+            if w_r * Ractiv and reg1 is None: reg1 = self.regul1(X0, L0)
+            if w_r2 * Ractiv and reg2 is None: reg2 = self.regul2(X0, L0, self.mask, ref_amp_0)
+            if w_r * Ractiv and reg3 is None: reg3 = self.regul3(X0, L0)
+
+            R1_0 = w_r * reg1 if w_r * Ractiv else 0
+            R2_0 = w_r2 * reg2 if w_r2 * Ractiv else 0
+            R3_0 = w_r3 * reg3 if w_r * Ractiv else 0
 
             loss0 += (R1_0 + R2_0 + R3_0)
         
@@ -560,33 +645,92 @@ class mustard_estimator:
         # ____________________________________
         # Nested functions
 
-        # Definition of minimizer step.
-        def closure():
-            nonlocal R1, R2, R3, loss, w_r, w_r2, w_r3, Lk, Xk, flux_k, fluxR_k, ref_amp_k
-            optimizer.zero_grad()  # Reset gradients
+        # Attributes fixed during the minimization, bound once instead of looked up at each step
+        regul1, regul2, regul3, mask = self.regul1, self.regul2, self.regul3, self.mask
+
+        # Data term of a way : weighted squared residual between a forward model and the data
+        def data_term(fwd, data):
+            return lambda *args: weighted_sq_sum(sqrt_weight, fwd(*args), data)
+
+        # If checkpointing, models are recomputed during backward instead of stored.
+        # ADI : the data term is computed by chunks of ~sqrt(nb_frame) frames, only one chunk of models is in memory.
+        if checkpointing and isinstance(self.model, model_ADI):
+            nb_rframe = self.model.nb_rframe
+            step = int(np.ceil(np.sqrt(nb_rframe)))
+            chunks = [slice(ii, ii + step) for ii in range(0, nb_rframe, step)]
+            frame_weight = sqrt_weight.dim() == 4 and sqrt_weight.shape[0] == nb_rframe  # Weight per frame
+
+            def data_term(fwd, data):
+                def chunk_term(*args, frames=slice(None)):
+                    return weighted_sq_sum(sqrt_weight[frames] if frame_weight else sqrt_weight,
+                                           fwd(*args, frames=frames), data[frames])
+                return lambda *args: sum(checkpoint(chunk_term, *args, frames=frames, use_reentrant=False)
+                                         for frames in chunks)
+
+        elif checkpointing:
+            def data_term(fwd, data):
+                return lambda *args: weighted_sq_sum(sqrt_weight, checkpoint(fwd, *args, use_reentrant=False), data)
+
+        # Data terms of the active ways : (weight, data term)
+        # (a way with a weight of 0 is not computed, resolved once here rather than at each step)
+        ways = []
+        if w_way[0]: ways.append((w_way[0], data_term(self.model.forward, science_data)))
+        if w_way[1]: ways.append((w_way[1], data_term(self.model.forward_ADI_reverse, science_data_derot)))
+
+        # Loss of the minimizer step. Only tensor operations : can be compiled (see compile_step)
+        # active : python flags of the active regularizations (weight != 0 and Ractiv)
+        def step_loss(Lk, Xk, flux_k, fluxR_k, ref_amp_k, w_r, w_r2, w_r3, active):
 
             # Background flux managment (beta)
             # bkg = self.compute_bkg(Xk[0])
             # with torch.no_grad() : Xk = Xk*self.coro
             # Lkb = Lk + bkg
 
-            # Compute model(s)
-            Yk = self.model.forward(Lk, Xk, flux_k, fluxR_k) if w_way[0] else 0
-            Yk_reverse = self.model.forward_ADI_reverse(Lk, Xk, flux_k, fluxR_k) if w_way[1] else 0
-
             # Compute regularization(s)
-            R1 = Ractiv * w_r  * self.regul1(Xk, Lk) if Ractiv * w_r else 0
-            R2 = Ractiv * w_r2 * self.regul2(Xk, Lk, self.mask, ref_amp_k) if Ractiv * w_r2 else 0
-            R3 = Ractiv * w_r3 * self.regul3(Xk, Lk) if Ractiv * w_r3 else 0
+            R1 = w_r  * regul1(Xk, Lk) if active[0] else 0
+            R2 = w_r2 * regul2(Xk, Lk, mask, ref_amp_k) if active[1] else 0
+            R3 = w_r3 * regul3(Xk, Lk) if active[2] else 0
+
+            # Compute model(s) and loss
+            loss = sum(w * term(Lk, Xk, flux_k, fluxR_k) for w, term in ways) + (R1 + R2 + R3)
+
+            return loss, R1, R2, R3
+
+        # Regularization arguments of step_loss : weights and active flags.
+        # If compiled, the weights are passed as tensors (a float is specialized : one compilation per weight value)
+        def step_reguls(weights, active):
+            if compile_step: weights = [torch.as_tensor(w, dtype=self.dtype, device=self.device) for w in weights]
+            return (*weights, tuple(bool(Ractiv * w) for w in active))
+
+        if compile_step:
+            step_loss = torch.compile(step_loss, mode=compile_step if isinstance(compile_step, str) else None)
+
+        # Definition of minimizer step.
+        def closure():
+            nonlocal R1, R2, R3, loss, w_r, w_r2, w_r3, Lk, Xk, flux_k, fluxR_k, ref_amp_k
+            optimizer.zero_grad()  # Reset gradients
 
             # Compute loss and local gradients
-            loss = w_way[0] * torch.sum(self.weight * (Yk - science_data) ** 2) + \
-                   w_way[1] * torch.sum(self.weight * (Yk_reverse - science_data_derot) ** 2) + \
-                   (R1 + R2 + R3)
+            weights = (w_r, w_r2, w_r3)
+            loss, R1, R2, R3 = step_loss(Lk, Xk, flux_k, fluxR_k, ref_amp_k, *step_reguls(weights, weights))
 
             loss.backward()
             return loss
 
+        # Optimizer on the varaibles to be estimated (built at start and at regularization activation)
+        def new_optimizer():
+            params = [Lk, Xk]
+            if estimI == "Both":
+                params += [flux_k, fluxR_k]
+            elif estimI == "Frame":
+                params += [flux_k]
+            elif estimI == "L":
+                params += [fluxR_k]
+            elif estimI == "ref":
+                params += [ref_amp_k]
+            for param in params: param.requires_grad = True
+            return optim.LBFGS(params, line_search_fn=line_search)
+
         # Definition of regularization activation
         def activation():
             nonlocal w_r, w_r2, w_r3, optimizer, Xk, Lk, flux_k, fluxR_k, ref_amp_k
@@ -610,21 +754,7 @@ class mustard_estimator:
                         if verbose: print("Impossible to compute regularization weight. Set to 0")
 
                 # Define the varaible to be estimated.
-                if estimI == "Both":
-                    optimizer = optim.LBFGS([Lk, Xk, flux_k, fluxR_k])
-                    flux_k.requires_grad = True;
-                    fluxR_k.requires_grad = True
-                elif estimI == "Frame":
-                    optimizer = optim.LBFGS([Lk, Xk, flux_k])
-                    flux_k.requires_grad = True
-                elif estimI == "L":
-                    optimizer = optim.LBFGS([Lk, Xk, fluxR_k])
-                    fluxR_k.requires_grad = True
-                elif estimI == "ref":
-                    optimizer = optim.LBFGS([Lk, Xk, ref_amp_k])
-                    ref_amp_k.requires_grad = True
-                else:
-                    optimizer = optim.LBFGS([Lk, Xk])
+                optimizer = new_optimizer()
 
                 if activ_step == "AJUSTED":
                     process_to_prints(activ_msg.format(activ_step, w_r, w_r2), -0.5)
@@ -632,38 +762,36 @@ class mustard_estimator:
         # Definition of print routines
         def process_to_prints(extra_msg=None, sub_iter=0.0, last=False):
             nonlocal txt_msg
+            if not (verbose or gif or save): return  # Nothing to print nor to save
             k_print = int(k) if sub_iter == 0 else k + sub_iter
             iter_msg = info_iter.format(k_print, *loss_ratio(Ractiv, float(R1), float(R2), float(loss)), loss)
             if extra_msg is not None: txt_msg += "\n" + extra_msg
             txt_msg += "\n" + iter_msg
             est_info = stat_msg.split("\n", 4)[3] + '\n'
-            if gif: print_iter(Lk, Xk, flux_k, k + sub_iter, est_info + iter_msg, extra_msg, save, self.coro)
+            if gif: print_iter(Lk, Xk, flux_k, k + sub_iter, est_info + iter_msg, extra_msg, save, self.coro_np)
             if verbose: print(iter_msg, end=overwrite if not last else "\n\n")
 
         # Define the varaible to be estimated.
-        if estimI == "Both":
-            optimizer = optim.LBFGS([Lk, Xk, flux_k, fluxR_k])
-            flux_k.requires_grad = True
-            fluxR_k.requires_grad = True
-        elif estimI == "Frame":
-            optimizer = optim.LBFGS([Lk, Xk, flux_k])
-            flux_k.requires_grad = True
-        elif estimI == "L":
-            optimizer = optim.LBFGS([Lk, Xk, fluxR_k])
-            fluxR_k.requires_grad = True
-        elif estimI == "ref":
-            optimizer = optim.LBFGS([Lk, Xk, ref_amp_k])
-            ref_amp_k.requires_grad = True
-        else:
-            optimizer = optim.LBFGS([Lk, Xk])
+        optimizer = new_optimizer()
 
-        # Save & prints the first iteration
-        loss_evo.append(loss)
+        # Save & prints the first iteration (losses are stored as floats : no tensor nor graph kept)
+        loss_evo.append(float(loss))
         self.last_iter = (L0, X0, flux_0, fluxR_k) if estimI else (L0, X0)
         if verbose: print(head)
         txt_msg += "\n" + head
         process_to_prints()
 
+        # Warm up : compile the step before the minimization (the loop iterations are not slowed down)
+        # The step is compiled for the current regularization state and, if it is activated later, the active one
+        # (weights are computed at activation : only the terms that can be activated matter).
+        if compile_step:
+            weights = (w_r, w_r2, w_r3)
+            step_loss(Lk, Xk, flux_k, fluxR_k, ref_amp_k, *step_reguls(weights, weights))
+            if kactiv and not Ractiv:
+                Ractiv = 1
+                step_loss(Lk, Xk, flux_k, fluxR_k, ref_amp_k, *step_reguls(weights, w_rp if w_pcent else weights))
+                Ractiv = 0
+
         start_time = datetime.now()
 
         # ____________________________________
@@ -684,16 +812,18 @@ class mustard_estimator:
 
                 # -- MINIMIZER STEP -- #
                 optimizer.step(closure)
-                if k > 1 and (torch.isnan(loss) or loss > loss_evo[-1]): self.final_estim = deepcopy(self.last_iter)
+                loss_val = float(loss)  # Read once on the host : the tests below don't sync with the device
+                if k > 1 and (np.isnan(loss_val) or loss_val > loss_evo[-1]):
+                    self.final_estim = tuple(var.detach().clone() for var in self.last_iter)
 
                 # Save & prints
-                loss_evo.append(loss)
+                loss_evo.append(loss_val)
 
                 self.last_iter = (Lk, Xk, flux_k, fluxR_k) if estimI else (Lk, Xk)
                 if k == 1: self.first_iter = (Lk, Xk, flux_k, fluxR_k) if estimI else (Lk, Xk)
 
                 # Break point (based on gtol)
-                grad = abs(loss[-1] - loss_evo[-2])
+                grad = abs(loss_evo[-1] - loss_evo[-2])
                 
                 if k > mink and  (grad < gtol) :
                     if not Ractiv and kactiv:  # If regul haven't been activated yet, continue with regul
@@ -704,7 +834,7 @@ class mustard_estimator:
                     else:
                         ending = 'max iter reached' if k == maxiter else 'Gtol reached'
                         break
-                elif torch.isnan(loss):  # Also break if an error occure.
+                elif np.isnan(loss_val):  # Also break if an error occure.
                     ending = 'Nan values end minimization. Last value estimated will be returned.'
                     break
 
@@ -723,21 +853,22 @@ class mustard_estimator:
         txt_msg += "\n\n" + end_msg
 
         if k > 1 and (torch.isnan(loss) or loss > loss_evo[-2]) and self.final_estim is not None:
-            L_est = abs(self.final_estim[0].detach().numpy()[0])
-            X_est = abs(self.final_estim[1].detach().numpy()[0])
+            L_fin, X_fin = self.final_estim[0], self.final_estim[1]
         else:
-            L_est, X_est = abs(Lk.detach().numpy()[0]), abs(Xk.detach().numpy()[0])
+            L_fin, X_fin = Lk, Xk
+
+        # abs on the device, only the frame of the estimation is brought back to the host
+        L_est, X_est = L_fin.detach()[0].abs().cpu().numpy(), X_fin.detach()[0].abs().cpu().numpy()
 
-        flux = abs(flux_k.detach().numpy())
-        fluxR = abs(fluxR_k.detach().numpy())
-        amp_ref = abs(ref_amp_k.detach().numpy())
-        loss_evo = [float(lossk.detach().numpy()) for lossk in loss_evo]
+        flux = flux_k.detach().abs().cpu().numpy()
+        fluxR = fluxR_k.detach().abs().cpu().numpy()
+        amp_ref = ref_amp_k.detach().abs().cpu().numpy()
 
         # Remove bkg flux from bkg_pup. (beta)
         bkg = 0  # np.median(X_est[np.where(self.pup_bkg==1)])
 
-        nice_L_est = self.coro.numpy() * (L_est + bkg).clip(min=0)
-        nice_X_est = self.coro.numpy() * (X_est - bkg).clip(min=0)
+        nice_L_est = self.coro_np * (L_est + bkg).clip(min=0)
+        nice_X_est = self.coro_np * (X_est - bkg).clip(min=0)
 
         # Result dict
         res = {'state': optimizer.state,
@@ -796,22 +927,24 @@ class mustard_estimator:
             raise (AssertionError("At least one argument must be provided"))
             
         if X0 is None:
-            X0 = np.mean(cube_derotate(self.science_data - L0, self.model.rot_angles), 0)
+            # derot(cube - L0) = derot(cube) - derot(L0) : the derotated cube is cached (host, float64),
+            # only L0 is rotated. Both with vip cube_derotate, same interpolation for the two terms.
+            L0_derot = cube_derotate(np.broadcast_to(L0, self.science_data.shape), self.model.rot_angles)
+            X0 = np.mean(self.get_science_data_derot(), 0) - np.mean(L0_derot, 0)
         elif L0 is None:
-            L0 = np.mean(self.science_data -
-                         cube_derotate(np.tile(X0, (self.nb_frame, 1, 1)), -self.model.rot_angles), 0)
+            L0 = np.mean(derotate_and_subtract(self.science_data, X0, -self.model.rot_angles), 0)
 
         self.L0x0 = (L0.clip(0), X0.clip(0))
 
     def configR1(self, mode: str, smoothL=True, p_L=1, p_X=1, epsi=1e-7):
         """ Configuration of first regularization. (smooth-like)"""
 
+        # Both sobel directions in one conv and one reduction (sum of x and y terms)
         if mode == "smooth_with_edges":
-            self.smooth = lambda X: torch.sum(self.coroR * sobel_tensor_conv(X, axis='y') ** 2 - epsi ** 2) + \
-                                    torch.sum(self.coroR * sobel_tensor_conv(X, axis='x') ** 2 - epsi ** 2)
+            epsi_sum = 2 * epsi ** 2 * self.coroR.numel()  # sum of the -epsi**2 of each pixel, for both axis
+            self.smooth = lambda X: torch.sum(self.coroR * sobel_sq_tensor_conv(X)) - epsi_sum
         elif mode == "smooth":
-            self.smooth = lambda X: torch.sum(sobel_tensor_conv(X, axis='y') ** 2) + \
-                                    torch.sum(sobel_tensor_conv(X, axis='x') ** 2)
+            self.smooth = lambda X: torch.sum(sobel_sq_tensor_conv(X))
 
         elif mode == "l1":
             self.smooth = lambda X: torch.sum(self.coroR * torch.abs(X))
@@ -878,7 +1011,7 @@ class mustard_estimator:
         if Msk is not None and (mode != 'mask' and mode != 'ref'):
             warnings.warn(UserWarning("You provided a mask but did not chose 'mask' option"))
 
-        self.F_rp = create_radial_prof_matirx(self.model.frame_shape)  # Radial profil transform
+        self.F_rp = create_radial_prof_matirx(self.model.frame_shape).to(self.device, self.dtype)  # Radial profil transform
         # y, x = np.indices(self.model.frame_shape)
         # self.yx = torch.from_numpy(y), torch.from_numpy(x)
 
@@ -895,20 +1028,25 @@ class mustard_estimator:
             elif penaliz == "L":
                 self.regul2 = lambda X, L, M: tsum(rM * (M - L) ** 2)
             elif penaliz in ("Both", "B"):
-                self.regul2 = lambda X, L, M: sign * (tsum(rM * (M - X) ** 2) -
-                                                      tsum(rM * (M - L) ** 2))
+                # rM(M-X)² - rM(M-L)² = rM.X² - rM.L² - 2.rM.M(X-L) : the rM.M² terms cancel, rM.M is constant
+                rM_M = rM * torch.as_tensor(Msk, dtype=rM.dtype, device=rM.device)
+                self.regul2 = lambda X, L, M: sign * (tsum(rM * X * X) - tsum(rM * L * L) -
+                                                      2 * tsum(rM_M * (X - L)))
 
         elif mode == "mask":
             Msk = Msk / torch.max(Msk)  # Normalize mask
             self.mask = (1 - Msk) if invert else Msk
+
+            # The mask is constant : rM.M² and rM.(1-M)² (and their ratio of sums) are computed once
+            Mt = torch.as_tensor(self.mask, dtype=rM.dtype, device=rM.device)
+            rM_M2, rM_1M2 = rM * Mt ** 2, rM * (1 - Mt) ** 2
             if penaliz == "X":
-                self.regul2 = lambda X, L, M, amp: tsum(rM * (M * X) ** 2)
+                self.regul2 = lambda X, L, M, amp: tsum(rM_M2 * X ** 2)
             elif penaliz == "L":
-                self.regul2 = lambda X, L, M, amp: tsum(rM * ((1 - M) * L) ** 2)
+                self.regul2 = lambda X, L, M, amp: tsum(rM_1M2 * L ** 2)
             elif penaliz in ("Both", "B"):
-                self.regul2 = lambda X, L, M, amp: tsum(rM * (M * X) ** 2) + \
-                                                   tsum(rM * M) ** 2 / tsum(rM * (1 - M)) ** 2 * \
-                                                   tsum(rM * ((1 - M) * L) ** 2) + \
+                coef_L = float(tsum(rM * Mt) ** 2 / tsum(rM * (1 - Mt)) ** 2)
+                self.regul2 = lambda X, L, M, amp: tsum(rM_M2 * X ** 2) + coef_L * tsum(rM_1M2 * L ** 2) + \
                                                    res_non_convexe(radial_profil(L, self.F_rp))
 
         elif mode == "l1":
@@ -921,9 +1059,10 @@ class mustard_estimator:
                 self.regul2 = lambda X, L, M: sign * (tsum(X ** 2) - tsum(L ** 2))
 
         elif mode == "ref":
-            self.mask = np.mean(cube_derotate(np.tile(Msk, (self.nb_frame, 1, 1)), self.model.rot_angles), axis=0)
-            self.mask = radial_profil(self.coro * torch.Tensor(self.mask), self.F_rp)
-            self.r2 = torch.linspace(0, len(self.mask), len(self.mask)) ** 2
+            Msk = torch.as_tensor(Msk, dtype=self.dtype, device=self.device)
+            self.mask = torch.mean(tensor_frame_derotate(Msk, self.model.rot_angles), 0).cpu().numpy()
+            self.mask = radial_profil(self.coro * torch.as_tensor(self.mask, device=self.device), self.F_rp)
+            self.r2 = torch.linspace(0, len(self.mask), len(self.mask), device=self.device) ** 2
             self.regul2 = lambda X, L, M, amp: tsum((amp * M - radial_profil(self.coro * torch.mean(
                 self.model.get_Lf(L, rot=True), dim=0)[0], self.F_rp)) ** 2)
 
@@ -942,11 +1081,10 @@ class mustard_estimator:
             """ Configuration of first regularization. (smooth-like)"""
     
             if mode == "smooth_with_edges":
-                self.smooth = lambda X: torch.sum(self.coroR * sobel_tensor_conv(X, axis='y') ** 2 - epsi ** 2) + \
-                                        torch.sum(self.coroR * sobel_tensor_conv(X, axis='x') ** 2 - epsi ** 2)
+                epsi_sum = 2 * epsi ** 2 * self.coroR.numel()
+                self.smooth = lambda X: torch.sum(self.coroR * sobel_sq_tensor_conv(X)) - epsi_sum
             elif mode == "smooth":
-                self.smooth = lambda X: torch.sum(sobel_tensor_conv(X, axis='y') ** 2) + \
-                                        torch.sum(sobel_tensor_conv(X, axis='x') ** 2)
+                self.smooth = lambda X: torch.sum(sobel_sq_tensor_conv(X))
     
             elif mode == "l1":
                 self.smooth = lambda X: torch.sum(self.coroR * torch.abs(X))
@@ -969,24 +1107,48 @@ class mustard_estimator:
         """Return input cube and angles"""
         return self.model.rot_angles, self.science_data
 
+    def get_science_data_derot(self):
+        """Return the derotated input cube (numpy, host). Computed at first call then reused."""
+        if self.science_data_derot is None:
+            self.science_data_derot = cube_derotate(self.science_data, self.model.rot_angles)
+        return self.science_data_derot
+
+    def get_science_data_derot_t(self):
+        """Return the derotated input cube as a tensor on the device. Computed at first call then reused."""
+        if self.science_data_derot_t is None:
+            self.science_data_derot_t = torch.as_tensor(self.get_science_data_derot(), dtype=self.dtype,
+                                                        device=self.device)
+        return self.science_data_derot_t
+
+    def get_model_cube(self, way="direct"):
+        """Return the model cube (tensor) of the last iteration. Computed once per way and per last_iter, then reused
+        by get_residual and get_reconstruction."""
+
+        cached = self.model_cubes.get(way)
+        if cached is not None and cached[0] is self.last_iter: return cached[1]
+
+        with torch.no_grad():
+            if way == "direct":
+                reconstructed_cube = self.model.forward(*self.last_iter)  # Reconstruction on last iteration
+            elif way == "reverse":
+                reconstructed_cube = self.model.forward_ADI_reverse(*self.last_iter)
+            else:
+                raise ValueError("way sould be 'reverse' or 'direct'")
+
+        self.model_cubes[way] = (self.last_iter, reconstructed_cube)
+        return reconstructed_cube
+
     def get_residual(self, way="direct", save=False):
         """Return input cube and angles"""
 
+        reconstructed_cube = self.get_model_cube(way)  # Reconstruction on last iteration
         if way == "direct":
-            science_data = torch.unsqueeze(torch.from_numpy(self.science_data), 1).double().to(self.device)
-            reconstructed_cube = self.model.forward(*self.last_iter)  # Reconstruction on last iteration
-            residual_cube = science_data - reconstructed_cube
-
-        elif way == "reverse":
-            science_data_derot_np = cube_derotate(self.science_data, self.model.rot_angles)
-            science_data = torch.unsqueeze(torch.from_numpy(science_data_derot_np), 1).double().to(self.device)
-            reconstructed_cube = self.model.forward_ADI_reverse(*self.last_iter)  # Reconstruction on last iteration
-            residual_cube = science_data - reconstructed_cube
-
+            science_data = torch.unsqueeze(self.science_data_t, 1)
         else:
-            raise (ValueError, "way sould be 'reverse' or 'direct'")
+            science_data = torch.unsqueeze(self.get_science_data_derot_t(), 1)
+        residual_cube = science_data - reconstructed_cube
 
-        nice_residual = self.coro.detach().numpy() * residual_cube.detach().numpy()[:, 0, :, :]
+        nice_residual = self.coro_np * residual_cube.detach().cpu().numpy()[:, 0, :, :]
         if save:
             savedir = save if isinstance(save, str) else self.savedir
             if not isdir(savedir): makedirs(savedir)
@@ -1023,12 +1185,12 @@ class mustard_estimator:
 
         return loss_evo
 
-    def get_speckles(self, show=True, save=False):
+    def get_speckles(self, show=True, save=False, n_jobs=1):
+        """Return speckles map (n_jobs : threads for the frame rotations, all the cpus if None)"""
 
         if self.speckles is None:
             res = np.min(self.science_data, 0)
-            self.ambiguities = np.min(cube_derotate(
-                np.tile(res, (self.nb_frame, 1, 1)), self.model.rot_angles), 0)
+            self.ambiguities = derotate_min(res, self.model.rot_angles, n_jobs)
             self.speckles = res - self.ambiguities
 
         if save:
@@ -1046,14 +1208,15 @@ class mustard_estimator:
     def get_result_unrotated(self):
         return self.res["x"]
 
-    def get_ambiguity(self, show=True, save=False):
+    def get_ambiguity(self, show=True, save=False, n_jobs=1):
+        """Return ambiguities map (n_jobs : threads for the frame rotations, all the cpus if None)"""
 
         if self.ambiguities is None:
             res = np.min(self.science_data, 0)
-            self.ambiguities = np.min(cube_derotate(np.tile(res, (self.nb_frame, 1, 1)), -self.model.rot_angles), 0)
+            self.ambiguities = derotate_min(res, -self.model.rot_angles, n_jobs)
 
-            self.stellar_halo = np.min(cube_derotate(np.tile(self.ambiguities, (50, 1, 1)),
-                                                     list(np.linspace(0, 360, 50))), 0)
+            # Min of the ambiguities rotated by 50 angles, reduced frame by frame (no rotated cube allocated)
+            self.stellar_halo = derotate_min(self.ambiguities, np.linspace(0, 360, 50), n_jobs)
 
         if save:
             if not isdir(self.savedir): makedirs(self.savedir)
@@ -1070,7 +1233,7 @@ class mustard_estimator:
     def get_rot_weight(self, show=True, save=False):
         """Return loss evolution"""
 
-        weight = self.ang_weight.detach().numpy()[:, 0, 0, 0]
+        weight = self.ang_weight.detach().cpu().numpy()[:, 0, 0, 0]
         rot_angles = self.model.rot_angles
 
         if show:
@@ -1104,7 +1267,7 @@ class mustard_estimator:
         amp_ref = self.res['amp_ref']
 
         L = torch.Tensor(L)
-        Rl = radial_profil(self.coro * L, self.F_rp).numpy()
+        Rl = radial_profil(torch.Tensor(self.coro_np) * L, self.F_rp).numpy()
         Rpsf = self.mask.numpy() * amp_ref
 
         plt.figure("Radial profile")
@@ -1156,18 +1319,17 @@ class mustard_estimator:
 
         Lk, _, flux_k, fluxR_k = self.last_iter
         if way == "direct":
-            science_data = torch.unsqueeze(torch.from_numpy(self.science_data), 1).double().to(self.device)
+            science_data = torch.unsqueeze(self.science_data_t, 1)
             reconstructed_cube = science_data - self.model.get_Lf(Lk, flux_k, fluxR_k)
 
         elif way == "reverse":
-            science_data_derot_np = cube_derotate(self.science_data, self.model.rot_angles)
-            science_data = torch.unsqueeze(torch.from_numpy(science_data_derot_np), 1).double().to(self.device)
+            science_data = torch.unsqueeze(self.get_science_data_derot_t(), 1)
             reconstructed_cube = science_data - self.model.get_Rx(Lk, flux_k, fluxR_k, inverse=True)
 
         else:
             raise (ValueError, "way sould be 'reverse' or 'direct'")
 
-        reconstructed_cube = reconstructed_cube.detach().numpy()[:, 0, :, :]
+        reconstructed_cube = reconstructed_cube.detach().cpu().numpy()[:, 0, :, :]
         if save:
             if not isdir(self.savedir): makedirs(self.savedir)
             write_fits(self.savedir + "/cube_without_speckles_" + way + "_" + self.name, reconstructed_cube)
@@ -1177,16 +1339,8 @@ class mustard_estimator:
     def get_reconstruction(self, way="direct", save=False):
         """Return input cube and angles"""
 
-        if way == "direct":
-            reconstructed_cube = self.model.forward(*self.last_iter)  # Reconstruction on last iteration
-
-        elif way == "reverse":
-            reconstructed_cube = self.model.forward_ADI_reverse(*self.last_iter)  # Reconstruction on last iteration
-
-        else:
-            raise (ValueError, "way sould be 'reverse' or 'direct'")
-
-        reconstructed_cube = self.coro.numpy() * reconstructed_cube.detach().numpy()[:, 0, :, :]
+        reconstructed_cube = self.get_model_cube(way)  # Reconstruction on last iteration
+        reconstructed_cube = self.coro_np * reconstructed_cube.detach().cpu().numpy()[:, 0, :, :]
         if save:
             if not isdir(self.savedir): makedirs(self.savedir)
             write_fits(self.savedir + "/reconstruction_" + way + "_" + self.name, reconstructed_cube)
@@ -1205,7 +1359,7 @@ class mustard_estimator:
             print("Save init from in " + self.savedir + "/L0X0" + "...")
 
             bkg = np.median(X0[np.where(self.pup_bkg == 1)])
-            nice_X0 = self.coro.numpy() * (X0 - bkg).clip(min=0)
+            nice_X0 = self.coro_np * (X0 - bkg).clip(min=0)
             L0 = L0 + bkg
 
             write_fits(self.savedir + "/L0X0/" + "/L0.fits", L0, verbose=False)
@@ -1221,8 +1375,8 @@ class mustard_estimator:
        cube = self.science_data
        ang = self.model.rot_angles
     
-       noise = self.coro.numpy() * self.get_residual()
-       flx, flxR = self.get_flux(show=False)
+       noise = self.coro_np * self.get_residual()
+       flx, flxR = self.res['flux'], self.res['fluxR']  # (get_flux would also draw the flux plots)
        flx = [1] + list(flx)
        flxR = [1] + list(flxR)
     
@@ -1235,39 +1389,51 @@ class mustard_estimator:
        vmin = cube.min()
     
        Rvmax = np.percentile(X, per_vmax) if r_no_scale else vmax
+       noise_p98 = np.percentile(noise.reshape(len(noise), -1), 98, axis=1)  # Color limits of each residual frame
+
+       # X rotated by the angle of each frame, all at once (one batched interpolation on the device)
+       X_rot = tensor_frame_derotate(torch.as_tensor(X, device=self.device), -np.asarray(ang)).cpu().numpy()
     
-       def plot_framek(val: int, show=True) -> None:
-    
+       def setup_axes() -> dict:
+           """ Axes, images and texts of the figure, created once. Returns the handles updated by plot_framek """
+
+           hdl = {}
+           ax = plt.subplot(1, 2, 1)
+           hdl["cube"] = ax.imshow(self.coro_np * cube[0], vmax=vmax, vmin=vmin, cmap='jet')
+           ax.text(20, 40, "ADI cube", dict(font, size=26))
+           hdl["title"] = ax.set_title("")
+           hdl["flux"] = ax.text(20, 55, "", dict(font, size=22))
+
+           ax = plt.subplot(2, 2, 4)
+           hdl["rot"] = ax.imshow(self.final_mask * X_rot[0], vmax=Rvmax, vmin=vmin, cmap='jet')
+           ax.text(20, 40, "Rotate", dict(font, size=22))
+
+           ax = plt.subplot(2, 4, 4)
+           hdl["static"] = ax.imshow(self.final_mask * L, vmax=vmax, vmin=vmin, cmap='jet')
+           ax.text(20, 40, "Static", dict(font, size=16))
+           hdl["fluxR"] = ax.text(20, 55, "", dict(font, size=12))
+
+           ax = plt.subplot(2, 4, 3)
+           hdl["noise"] = ax.imshow(noise[0], cmap='jet')
+           ax.text(20, 40, "Random", dict(font, size=16, color="red"))
+
+           return hdl
+
+       def plot_framek(val: int, hdl: dict, show=True) -> None:
+           """ Update the figure (handles of setup_axes) with the frame val """
+
            num = int(val)
-           font["size"] = 26
-           font["color"] = "white"
-    
-           plt.subplot(1, 2, 1)
-           plt.imshow(self.coro.numpy() * cube[num], vmax=vmax, vmin=vmin, cmap='jet')
-           plt.text(20, 40, "ADI cube", font)
-           plt.title("Frame n°" + str(num))
-           font["size"] = 22
-           plt.text(20, 55, r'$\Delta$ Flux : 1{:+.2e}'.format(1 - flx[num]), font)
-    
-           font["size"] = 22
-           plt.subplot(2, 2, 4)
-           plt.imshow(self.final_mask * flx[num] * frame_rotate(X, ang[num]), vmax=Rvmax, vmin=vmin, cmap='jet')
-           plt.text(20, 40, "Rotate", font)
-    
-           font["size"] = 16
-           plt.subplot(2, 4, 4)
-           plt.imshow(self.final_mask * flxR[num] * flx[num] * L, vmax=vmax, vmin=vmin, cmap='jet')
-           plt.text(20, 40, "Static", font)
-           font["size"] = 12
-           plt.text(20, 55, r'$\Delta$ Flux : 1{:+.2e}'.format(1 - flxR[num]), font)
-    
-           font["size"] = 16
-           font["color"] = "red"
-    
-           plt.subplot(2, 4, 3)
-           plt.imshow(noise[num], cmap='jet')
-           plt.clim(-np.percentile(noise[num], 98), +np.percentile(noise[num], 98))
-           plt.text(20, 40, "Random", font)
+           hdl["cube"].set_data(self.coro_np * cube[num])
+           hdl["title"].set_text("Frame n°" + str(num))
+           hdl["flux"].set_text(r'$\Delta$ Flux : 1{:+.2e}'.format(1 - flx[num]))
+
+           hdl["rot"].set_data(self.final_mask * flx[num] * X_rot[num])
+
+           hdl["static"].set_data(self.final_mask * flxR[num] * flx[num] * L)
+           hdl["fluxR"].set_text(r'$\Delta$ Flux : 1{:+.2e}'.format(1 - flxR[num]))
+
+           hdl["noise"].set_data(noise[num])
+           hdl["noise"].set_clim(-noise_p98[num], +noise_p98[num])
            if show: plt.show()
     
        # ax_slid = plt.axes([0.1, 0.25, 0.0225, 0.63])
@@ -1275,31 +1441,19 @@ class mustard_estimator:
        # handler.on_changed(plot_framek)
     
        plt.ioff()
-       plt.figure("TMP_MUSTARD", figsize=(16, 14))
+       fig = plt.figure("TMP_MUSTARD", figsize=(16, 14))
+       plt.clf()
        if not isdir(self.savedir): makedirs(self.savedir)
-       if not isdir(self.savedir + "/tmp/"): makedirs(self.savedir + "/tmp/")
-    
+
+       # Axes are built once, each frame only updates the images and texts.
+       # Frames are rendered in memory (agg canvas) rather than written to and read back from png files
+       hdl = setup_axes()
        images = []
        for num in range(len(cube)):
-           plt.cla();
-           plt.clf()
-           plot_framek(num, show=False)
-           plt.savefig(self.savedir + "/tmp/noise_" + str(num) + ".png")
-    
-       for num in range(len(cube)):
-           images.append(Image.open(self.savedir + "/tmp/noise_" + str(num) + ".png"))
-    
-       for num in range(len(cube)):
-           try:
-               remove(self.savedir + "/tmp/noise_" + str(num) + ".png")
-           except Exception as e:
-               print("[WARNING] Failed to delete iter .png : " + str(e))
-    
-       try:
-           rmdir(self.savedir + "/tmp/")
-       except Exception as e:
-           print("[WARNING] Failed to remove iter dir : " + str(e))
-    
+           plot_framek(num, hdl, show=False)
+           fig.canvas.draw()
+           images.append(Image.fromarray(np.array(fig.canvas.buffer_rgba())))
+
        images[0].save(fp=self.savedir + "MUSTARD.gif", format='GIF',
                       append_images=images, save_all=True, duration=200, loop=0)
     
@@ -1309,12 +1463,105 @@ class mustard_estimator:
 # %% -----Small util function ----------------------------------------------------
 # Could be moved to utils / algos module...
 
+def weighted_sq_sum(sqrt_weight: torch.Tensor, Y: torch.Tensor, ref: torch.Tensor) -> torch.Tensor:
+    """sum(sqrt_weight**2 * (Y - ref)**2), as the squared norm of the weighted residual (sub, mul, dot).
+    The residual is weighted in place when its shape allows it (one cube temporary less per call).
+    Autograd safe : the subtraction does not need its output for backward."""
+
+    res = Y - ref
+    res = res.mul_(sqrt_weight) if torch.broadcast_shapes(res.shape, sqrt_weight.shape) == res.shape \
+        else res * sqrt_weight
+    res = res.reshape(-1)
+    return torch.dot(res, res)
+
 def find_nearest(array, value):
     array = np.asarray(array)
     idx = (np.abs(array - value)).argmin()
     return array[idx]
 
-            
+
+def derotate_frames(cube: np.ndarray, angles: np.array, n_jobs=1) -> np.ndarray:
+    """Same as cube_derotate, with the frames rotated in a pool of n_jobs threads (all the cpus if None).
+    frame_rotate releases the GIL in its inner call : threads scale without the pickling cost of processes."""
+
+    if n_jobs == 1:
+        return cube_derotate(cube, angles)
+
+    with ThreadPoolExecutor(max_workers=n_jobs or cpu_count()) as pool:
+        return np.stack(list(pool.map(lambda i: frame_rotate(cube[i], -angles[i]), range(len(angles)))))
+
+def derotate_and_subtract(cube: np.ndarray, res: np.ndarray, angles: np.array, n_jobs=1) -> np.ndarray:
+    """Subtract from each frame of the cube the frame res rotated by the matching angle.
+    The frame is broadcast (no copy) and rotated with one cube_derotate call instead of per-frame.
+    The subtraction is written in the rotated cube buffer (no extra cube allocated)."""
+
+    ref = np.broadcast_to(res, cube.shape)
+    rot = derotate_frames(ref, angles, n_jobs)
+    np.subtract(cube, rot, out=rot)
+    return rot
+
+def median_frames(cube: np.ndarray) -> np.ndarray:
+    """Median of the cube along the frame axis, using a partial sort (select of the middle frame(s) only)."""
+
+    nb_frm = cube.shape[0]
+    mid = nb_frm // 2
+    if nb_frm % 2:
+        return np.partition(cube, mid, axis=0)[mid].copy()
+
+    part = np.partition(cube, (mid - 1, mid), axis=0)
+    return (part[mid - 1] + part[mid]) / 2
+
+def tensor_median_frames(cube: torch.Tensor) -> torch.Tensor:
+    """Median of the cube along the frame axis (torch version of median_frames, mean of the two middle values
+    for an even number of frames as np.median)."""
+
+    nb_frm = cube.shape[0]
+    mid = nb_frm // 2
+    if nb_frm % 2:
+        return torch.kthvalue(cube, mid + 1, dim=0).values
+
+    return (torch.kthvalue(cube, mid, dim=0).values + torch.kthvalue(cube, mid + 1, dim=0).values) / 2
+
+def max_common_init_torch(cube: torch.Tensor, angles: np.array, ref_mask: torch.Tensor) -> tuple:
+    """Max common initialisation of the ADI mode computed with torch on the device of the cube.
+    Same steps as the numpy version in estimate, with tensor_cube_derotate (bilinear) for the rotations.
+    Returns the derotated cube, L0 and X0."""
+
+    ref_mask = torch.as_tensor(ref_mask, dtype=cube.dtype, device=cube.device)
+    cube_derot = tensor_cube_derotate(cube, angles)
+
+    med_L = tensor_median_frames(cube).clamp(min=0)
+    R_fr = cube_derot - tensor_frame_derotate(med_L, -angles)
+    res_R = torch.mean(R_fr, 0).clamp(min=0)
+    del R_fr
+
+    med_R = tensor_median_frames(cube_derot).clamp(min=0)
+    L_fr = cube - tensor_frame_derotate(med_R, angles)
+    res_L = torch.mean(L_fr, 0).clamp(min=0)
+    del L_fr
+
+    L0 = med_L * (1 - ref_mask) + res_L * ref_mask
+    X0 = med_R * ref_mask + res_R * (1 - ref_mask)
+
+    return cube_derot, L0, X0
+
+def derotate_min(frame: np.ndarray, angles: np.array, n_jobs=1) -> np.ndarray:
+    """Minimum of the frame derotated by each angle. Same as np.min(cube_derotate(tiled frame, angles), 0)
+    but reduced frame by frame : the derotated cube is never allocated.
+    The rotations can be run in a pool of n_jobs threads (all the cpus if None)."""
+
+    res_min = np.full(frame.shape, np.inf)
+    if n_jobs == 1:
+        for ang in angles:
+            np.minimum(res_min, frame_rotate(frame, -ang), out=res_min)
+        return res_min
+
+    with ThreadPoolExecutor(max_workers=n_jobs or cpu_count()) as pool:
+        for rot in pool.map(lambda ang: frame_rotate(frame, -ang), angles):
+            np.minimum(res_min, rot, out=res_min)
+
+    return res_min
+
 def cube_rotate(cube, angles):
     new_cube = torch.zeros(cube.shape)
     for ii in range(len(angles)):
@@ -1325,8 +1572,9 @@ def cube_rotate(cube, angles):
 def normlizangle(angles: np.array) -> np.array:
     """Normaliz an angle between 0 and 360"""
 
+    angles = np.array(angles, dtype=float)  # Own copy : the input angles are not modified, then updated in place
     angles[angles < 0] += 360
-    angles = angles % 360
+    np.mod(angles, 360, out=angles)
 
     return angles
 
@@ -1338,31 +1586,36 @@ def compute_rot_weight(angs: np.array) -> np.array:
     # if max_rot > 1 : max_rot = 1
     max_rot = 100
 
-    ang_weight = []
-    for id_ang, ang in enumerate(angs):
-        # If a frame neighbours delta-rot under max_rot, frames are less valuable than other frame (weight<1)
-        # If the max_rot is exceed, the frame is not consider not more valuable than other frame (weight=1)
-        # We do this for both direction's neighbourhoods
-
-        nb_neighbours = 0;
-        detla_ang = 0
-        tmp_id = id_ang
-
-        while detla_ang < max_rot and tmp_id < nb_frm - 1:  # neighbours after
-            tmp_id += 1;
-            nb_neighbours += 1
-            detla_ang += abs(angs[tmp_id] - angs[id_ang])
-        w_1 = (1 + abs(angs[id_ang] - angs[id_ang + 1])) / nb_neighbours if nb_neighbours > 1 else 1
-
-        tmp_id = id_ang;
-        detla_ang = 0
-        nb_neighbours = 0
-        while detla_ang < max_rot and tmp_id > 0:  # neighbours before
-            tmp_id -= 1;
-            nb_neighbours += 1
-            detla_ang += abs(angs[tmp_id] - angs[id_ang])
-        w_2 = (1 + abs(angs[id_ang] - angs[id_ang - 1])) / nb_neighbours if nb_neighbours > 1 else 1
-
-        ang_weight.append((w_2 + w_1) / 2)
-
-    return np.array(ang_weight)
+    # If a frame neighbours delta-rot under max_rot, frames are less valuable than other frame (weight<1)
+    # If the max_rot is exceed, the frame is not consider not more valuable than other frame (weight=1)
+    # We do this for both direction's neighbourhoods :
+    # nb of neighbours needed for the cumulated delta-rot |angs[j] - angs[i]| to reach max_rot (or the cube edge).
+    # All the frames step to their next neighbour together, until each one reached max_rot or the edge.
+    angs = np.asarray(angs, dtype=float)
+    ids = np.arange(nb_frm)
+    nb_neighbours = {}
+
+    for sgn in (1, -1):  # neighbours after, then before
+        edge = nb_frm - 1 - ids if sgn > 0 else ids
+        nb_neighbours[sgn] = edge.copy()
+        detla_ang = np.zeros(nb_frm)
+        active = ids[edge > 0] if max_rot > 0 else ids[:0]
+        tmp_id = 0
+        while active.size:
+            tmp_id += 1
+            detla_ang[active] += np.abs(angs[active + sgn * tmp_id] - angs[active])
+            reached = detla_ang[active] >= max_rot
+            nb_neighbours[sgn][active[reached]] = tmp_id
+            active = active[~reached]
+            active = active[edge[active] > tmp_id]
+
+    nb_after, nb_before = nb_neighbours[1], nb_neighbours[-1]
+
+    # (1 + delta-rot with the next/previous frame) / nb of neighbours. No neighbour at the cube edges (weight=1)
+    delta_next = np.abs(np.diff(angs))
+    w_1 = np.ones(nb_frm)
+    w_1[:-1] = np.where(nb_after[:-1] > 1, (1 + delta_next) / np.maximum(nb_after[:-1], 1), 1)
+    w_2 = np.ones(nb_frm)
+    w_2[1:] = np.where(nb_before[1:] > 1, (1 + delta_next) / np.maximum(nb_before[1:], 1), 1)
+
+    return (w_2 + w_1) / 2
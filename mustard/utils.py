@@ -68,17 +68,21 @@ def circle(shape: tuple, r: float, offset=(0.5, 0.5)):
     nb_f  = shape[0]  if len(shape) == 3 else 0
     shape = shape[1:] if len(shape) == 3 else shape
 
-    M = np.zeros(shape)
-    w, l = shape
-    for x in range(0, w):
-        for y in range(0, l):
-            if pow(x - (w // 2) + offset[0], 2) + pow(y - (l // 2) + offset[1], 2) < pow(r, 2):
-                M[x, y] = 1
+    M = (sq_radius_map(shape, offset) < pow(r, 2)).astype(float)
 
     if nb_f: M = np.tile(M, (nb_f, 1, 1))
 
     return M
 
+def sq_radius_map(shape: tuple, offset=(0.5, 0.5)) -> np.ndarray:
+    """ Squared distance of each pixel to the center (w//2 - offset, l//2 - offset) of a 2D matrix.
+        circle(shape, r) is sq_radius_map(shape) < r**2 : compute it once to derive several circles. """
+    if isinstance(offset, (int, float)): offset = (offset, offset)
+    w, l = shape
+    x, y = np.ogrid[0:w, 0:l]
+
+    return (x - (w // 2) + offset[0]) ** 2 + (y - (l // 2) + offset[1]) ** 2
+
 def ellipse(shape: tuple, small_ax: float, big_ax: float, rotation: float, off_center=(0, 0)) -> np.ndarray:
     """ Create ellipse of 1 in a 2D matrix of zeros"
 
@@ -139,13 +143,12 @@ def gaussian(shape, sigma = 1, mu = 0) :
 # %% Plot
 
 def print_iter(L: torch.Tensor, x: torch.Tensor, flux: torch.Tensor, bfgs_iter: int, msg_box: str,
-               extra_msg: str or None, datadir: str or bool, coro : torch.Tensor(1)) -> None:
+               extra_msg: str or None, datadir: str or bool, coro : np.ndarray) -> None:
     """ Generate the standard plot of MUSTARD. Evolution at each iteration will be shadow ploted and saved."""
 
-    L_np  = abs(L.detach().numpy()[0, :, :])
-    X_np  = abs(x.detach().numpy()[0, :, :])
-    coro  = coro.numpy()
-    fluxnp = flux.detach().numpy()
+    L_np  = abs(L.detach().cpu().numpy()[0, :, :])
+    X_np  = abs(x.detach().cpu().numpy()[0, :, :])
+    fluxnp = flux.detach().cpu().numpy()
 
     plt.ioff()
     col = 3 if flux.requires_grad else 2